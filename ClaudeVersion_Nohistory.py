@@ -1,15 +1,9 @@
-import openai
 import streamlit as st
-from openai import OpenAI
-import pinecone
-from pinecone import Pinecone
 from typing import Dict, List
 from dataclasses import dataclass
 from enum import Enum
-import json
-
-# Initialize OpenAI Client
-client = OpenAI()
+from intake_state import IntakeExtractor, IntakeTracker
+from warmup import Warmup
 
 # ---- Constants and Configuration ----
 class ModelTier(Enum):
@@ -32,6 +26,12 @@ MODEL_CONFIGS = {
     "text-embedding-3-large": ModelConfig("text-embedding-3-large", 100, 0.0004, 3072, 100, 0.90)
 }
 
+# Messages the intake record already covers are left out of the prompt, except
+# for this many recent ones
+RECENT_MESSAGES = 12
+# Only the most recent retrieval results are resent with each request
+MAX_CONTEXT_BLOCKS = 6
+
 INITIAL_GREETING = """Hello! I'm the Collins Family Mediation Intermediary. I'm here to gather information and clarify issues to help you get a head start on your mediation sessions with the Collinses. To get started, could you please tell me your first name?"""
 
 SYSTEM_MESSAGE = """
@@ -66,7 +66,7 @@ class APIManager:
 
     def query_pinecone(self, user_input: str) -> str:
         try:
-            response = client.embeddings.create(
+            response = get_openai_client().embeddings.create(
                 model="text-embedding-3-large",
                 input=user_input
             )
@@ -98,7 +98,7 @@ class APIManager:
 
     def generate_response(self, messages: List[Dict]) -> str:
         try:
-            response = client.chat.completions.create(
+            response = get_openai_client().chat.completions.create(
                 model="gpt-4o",
                 messages=messages,
                 temperature=0.7
@@ -110,63 +110,119 @@ class APIManager:
             print(f"Error in generate_response: {str(e)}")
             return "I apologize, but I encountered an error processing your request."
 
-def initialize_session_state():
-    if 'initialized' not in st.session_state:
-        st.session_state.initialized = True
-        st.session_state.messages = [
+# Heavy client libraries are imported on first use rather than at script start
+def build_openai_client():
+    # Initialize OpenAI Client
+    from openai import OpenAI
+    return OpenAI()
+
+def build_pinecone_index():
+    from pinecone import Pinecone
+    pc = Pinecone(api_key=st.secrets["pinecone"]["api_key"])
+    return pc.Index("mediation4")
+
+@st.cache_resource
+def get_warm_resources():
+    # Started once per server process by the first session; the clients and
+    # index handle are built in the background while the page renders
+    return Warmup(
+        builders={
+            "openai": build_openai_client,
+            "pinecone_index": build_pinecone_index,
+        },
+        warmers={
+            "pinecone_index": lambda index: index.describe_index_stats(),
+        }
+    )
+
+def get_openai_client():
+    return get_warm_resources().get("openai")
+
+# replay_eval.py passes its own state object
+def initialize_session_state(state=None):
+    state = st.session_state if state is None else state
+    if 'initialized' not in state:
+        state.initialized = True
+        state.messages = [
             {"role": "system", "content": SYSTEM_MESSAGE},
             {"role": "assistant", "content": INITIAL_GREETING}
         ]
-        st.session_state.user_name = ""
-        st.session_state.spouse_name = ""
-        st.session_state.current_issue = None
-        st.session_state.issues_discussed = []
-        st.session_state.backend_messages = []
-        st.session_state.current_response = INITIAL_GREETING  # New: store current response
+        state.user_name = ""
+        state.spouse_name = ""
+        state.current_issue = None
+        state.issues_discussed = []
+        state.backend_messages = []
+        state.intake = None  # Filled in after each turn; created on the first one so page load never waits on the client
+        state.current_response = INITIAL_GREETING  # New: store current response
+
+def handle_turn(api_manager, state, user_input: str, render) -> str:
+    # One user turn against the session state; replay_eval.py runs this same function
+    if state.intake is None:
+        state.intake = IntakeTracker(IntakeExtractor(get_openai_client()))
+
+    # Add user message to conversation history (but don't display)
+    state.messages.append({"role": "user", "content": user_input})
+
+    # Query Pinecone and add to backend context
+    relevant_info = api_manager.query_pinecone(user_input)
+    if relevant_info:
+        state.backend_messages.append({
+            "role": "system", 
+            "content": f"Consider this relevant information when responding:\n{relevant_info}"
+        })
+        del state.backend_messages[:-MAX_CONTEXT_BLOCKS]
+
+    # Pick up the latest intake record without waiting on a pending extraction
+    intake = state.intake.current()
+    state.user_name = intake.user_name
+    state.spouse_name = intake.spouse_name
+    state.current_issue = intake.current_issue
+    state.issues_discussed = intake.issues_discussed
+
+    # Combine messages for API call
+    intake_block = intake.to_prompt_block()
+    # The greeting and the first turns_processed exchanges are in the record
+    history = state.messages[1:]
+    covered = 1 + 2 * intake.turns_processed if intake.turns_processed else 0
+    history = history[max(0, min(covered, len(history) - RECENT_MESSAGES)):]
+    full_context = (
+        [state.messages[0]]  # System message
+        + ([{"role": "system", "content": intake_block}] if intake_block else [])  # Intake record
+        + state.backend_messages  # Backend context
+        + history  # Conversation history
+    )
+
+    # Generate response and update current_response
+    response = api_manager.generate_response(full_context)
+    state.current_response = response
+    state.messages.append({"role": "assistant", "content": response})
+    
+    # Render the reply in place; no second script run needed
+    render(response)
+
+    # Update the intake record in the background with the cheap model
+    state.intake.observe_turn(user_input, response)
+    return response
 
 def main():
+    get_warm_resources()
     st.title("Collins Family Mediation Assistant")
     
     # Initialize session state
     initialize_session_state()
     
-    # Initialize Pinecone
-    pc = Pinecone(api_key=st.secrets["pinecone"]["api_key"])
-    index = pc.Index("mediation4")
-    api_manager = APIManager(index)
-
     # Only display the current response
-    st.write(st.session_state.current_response)
+    response_placeholder = st.empty()
+    response_placeholder.write(st.session_state.current_response)
 
     # Handle user input
     user_input = st.chat_input("Your response:")
     
     if user_input:
-        # Add user message to conversation history (but don't display)
-        st.session_state.messages.append({"role": "user", "content": user_input})
-
-        # Query Pinecone and add to backend context
-        relevant_info = api_manager.query_pinecone(user_input)
-        if relevant_info:
-            st.session_state.backend_messages.append({
-                "role": "system", 
-                "content": f"Consider this relevant information when responding:\n{relevant_info}"
-            })
-
-        # Combine messages for API call
-        full_context = (
-            [st.session_state.messages[0]]  # System message
-            + st.session_state.backend_messages  # Backend context
-            + st.session_state.messages[1:]  # Conversation history
-        )
-
-        # Generate response and update current_response
-        response = api_manager.generate_response(full_context)
-        st.session_state.current_response = response
-        st.session_state.messages.append({"role": "assistant", "content": response})
-        
-        # Force a rerun to update the display
-        st.rerun()
+        # Only a turn waits for the index handle; the page renders while the
+        # warmup is still building it
+        api_manager = APIManager(get_warm_resources().get("pinecone_index"))
+        handle_turn(api_manager, st.session_state, user_input, response_placeholder.write)
 
 if __name__ == "__main__":
     main()
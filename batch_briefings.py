@@ -0,0 +1,302 @@
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List
+
+from token_utils import count_tokens
+
+# Nightly job that turns completed intake conversations into briefings for the
+# Collins mediators. Conversations are read from the transcript store (or the
+# vector index), summarized through a rate-limited worker pool and written out
+# as Markdown. Progress is checkpointed, so an interrupted run picks up where it
+# stopped.
+#
+#   python batch_briefings.py --transcript-store transcripts.db --out briefings/
+#   python batch_briefings.py --transcript-store mongodb://host/ --out briefings/
+#   python batch_briefings.py --fake --transcript-store transcripts.db --out /tmp/briefings
+#   python batch_briefings.py --local-index index.json --metadata-store metadata_store.db --out briefings/
+#   python batch_briefings.py --transcript-store transcripts.db --export-batch batch.jsonl --out briefings/
+#   python batch_briefings.py --import-batch batch_output.jsonl --out briefings/
+
+BRIEFING_MODEL = "gpt-4o-mini"
+# Longer transcripts are cut from the middle so the opening facts and the
+# closing summary both survive
+MAX_TRANSCRIPT_TOKENS = 12000
+CHECKPOINT_FILE = "checkpoint.json"
+
+BRIEFING_PROMPT = """You are preparing a confidential briefing for the Collins Family Mediation mediators ahead of an
+in-person session. From the intake conversation below, write a concise Markdown briefing with these sections:
+Parties, Marriage and Separation, Living Arrangements, Children and Parenting, Finances and Property,
+Emotional Priorities and Goals, Client's View of the Other Spouse, Points of Likely Agreement,
+Areas of Conflict, Open Questions for the Mediators.
+Only include what the client actually said; write "Not discussed" for anything missing."""
+
+class RateLimiter:
+    # Token bucket over requests and tokens per minute, shared by all workers
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._request_allowance = requests_per_minute
+        self._token_allowance = tokens_per_minute
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: int):
+        tokens = min(tokens, self.tokens_per_minute)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                elapsed_minutes = (now - self._updated) / 60
+                self._updated = now
+                self._request_allowance = min(
+                    self.requests_per_minute, self._request_allowance + elapsed_minutes * self.requests_per_minute
+                )
+                self._token_allowance = min(
+                    self.tokens_per_minute, self._token_allowance + elapsed_minutes * self.tokens_per_minute
+                )
+                if self._request_allowance >= 1 and self._token_allowance >= tokens:
+                    self._request_allowance -= 1
+                    self._token_allowance -= tokens
+                    return
+                wait_minutes = max(
+                    (1 - self._request_allowance) / self.requests_per_minute,
+                    (tokens - self._token_allowance) / self.tokens_per_minute
+                )
+            time.sleep(max(0.01, wait_minutes * 60))
+
+class Checkpoint:
+    def __init__(self, out_dir: str):
+        self.path = os.path.join(out_dir, CHECKPOINT_FILE)
+        self._lock = threading.Lock()
+        self.completed = set()
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                self.completed = set(json.load(f)["completed"])
+
+    def mark_done(self, conversation_id: str):
+        with self._lock:
+            self.completed.add(conversation_id)
+            temporary_path = self.path + ".tmp"
+            with open(temporary_path, "w", encoding="utf-8") as f:
+                json.dump({"completed": sorted(self.completed)}, f)
+            os.replace(temporary_path, self.path)
+
+def format_transcript(turns: List[Dict], max_tokens: int = MAX_TRANSCRIPT_TOKENS) -> str:
+    lines = [f"{turn['role'].title()}: {turn['content']}" for turn in turns]
+    if count_tokens("\n".join(lines)) <= max_tokens:
+        return "\n".join(lines)
+    # Take lines alternately from the start and the end until the budget is spent
+    head, tail, used = [], [], 0
+    start, end = 0, len(lines) - 1
+    while start <= end:
+        from_start = len(head) <= len(tail)
+        line = lines[start] if from_start else lines[end]
+        tokens = count_tokens(line)
+        if used + tokens > max_tokens:
+            break
+        used += tokens
+        if from_start:
+            head.append(line)
+            start += 1
+        else:
+            tail.append(line)
+            end -= 1
+    return "\n".join(head + ["[... middle of conversation omitted ...]"] + list(reversed(tail)))
+
+def build_request(conversation_id: str, turns: List[Dict]) -> Dict:
+    return {
+        "custom_id": conversation_id,
+        "model": BRIEFING_MODEL,
+        "messages": [
+            {"role": "system", "content": BRIEFING_PROMPT},
+            {"role": "user", "content": format_transcript(turns)},
+        ],
+        "temperature": 0.3,
+    }
+
+def load_from_transcript_store(location: str, idle_hours: float) -> Dict[str, List[Dict]]:
+    from transcript_store import open_transcript_store
+    store = open_transcript_store(location)
+    return {
+        conversation_id: store.load(conversation_id)
+        for conversation_id in store.conversations(idle_seconds=idle_hours * 3600)
+    }
+
+def load_from_index(index, idle_hours: float, metadata_store=None) -> Dict[str, List[Dict]]:
+    # Conversations already rolled up by compact_conversations.py are briefed
+    # from their summaries, followed by any turns written since
+    from compact_conversations import (
+        fetch_conversation_vectors, group_by_conversation, has_turn_order, reassemble_turns
+    )
+    cutoff = time.time() - idle_hours * 3600
+    conversations = {}
+    for conversation_id, group in group_by_conversation(fetch_conversation_vectors(index, metadata_store)).items():
+        summaries = [
+            vector["metadata"] for _, vector in
+            sorted(group["summaries"], key=lambda item: int(item[0].rsplit("_", 1)[1]))
+        ]
+        if not has_turn_order(group["messages"]):
+            # Turns stored before positions existed cannot be put back in order;
+            # brief those from the transcript store instead
+            print(f"Error in load_from_index: no turn order for conversation {conversation_id} "
+                  f"(use --transcript-store)")
+            continue
+        turns = [turn["metadata"] for turn in reassemble_turns(group["messages"])]
+        timestamps = [item["created_at"] for item in summaries + turns if item.get("created_at") is not None]
+        if timestamps and max(timestamps) > cutoff:
+            continue
+        if any(not item.get("snippet") for item in summaries + turns):
+            print(f"Error in load_from_index: no text for conversation {conversation_id} "
+                  f"(id-only index? pass --metadata-store)")
+            continue
+        conversations[conversation_id] = (
+            [{"role": "summary", "content": summary["snippet"]} for summary in summaries]
+            + [{"role": turn.get("role", "unknown"), "content": turn["snippet"]} for turn in turns]
+        )
+    return conversations
+
+def write_briefing(out_dir: str, conversation_id: str, briefing: str):
+    with open(os.path.join(out_dir, f"{conversation_id}.md"), "w", encoding="utf-8") as f:
+        f.write(f"# Mediator briefing: conversation {conversation_id}\n\n{briefing.strip()}\n")
+
+def generate_briefings(client, conversations: Dict[str, List[Dict]], out_dir: str,
+                       limiter: RateLimiter, workers: int = 4, max_retries: int = 3) -> Dict[str, int]:
+    os.makedirs(out_dir, exist_ok=True)
+    checkpoint = Checkpoint(out_dir)
+    todo = {cid: turns for cid, turns in conversations.items() if cid not in checkpoint.completed and turns}
+
+    def run(conversation_id: str, turns: List[Dict]):
+        request = build_request(conversation_id, turns)
+        estimated_tokens = sum(count_tokens(message["content"]) for message in request["messages"]) + 800
+        for attempt in range(max_retries + 1):
+            limiter.acquire(estimated_tokens)
+            try:
+                response = client.chat.completions.create(
+                    model=request["model"], messages=request["messages"], temperature=request["temperature"]
+                )
+                write_briefing(out_dir, conversation_id, response.choices[0].message.content)
+                checkpoint.mark_done(conversation_id)
+                return
+            except Exception as e:
+                if attempt == max_retries:
+                    raise
+                print(f"Error generating briefing for {conversation_id} (attempt {attempt + 1}): {str(e)}")
+                time.sleep(2 ** attempt)
+
+    failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(run, cid, turns): cid for cid, turns in todo.items()}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                failed += 1
+                print(f"Giving up on briefing for {futures[future]}: {str(e)}")
+    return {
+        "skipped": len(conversations) - len(todo),
+        "written": len(todo) - failed,
+        "failed": failed,
+    }
+
+def export_batch(conversations: Dict[str, List[Dict]], path: str, out_dir: str) -> int:
+    # Requests in the OpenAI Batch API input format, for the discounted async
+    # path; conversations already briefed in out_dir are left out
+    checkpoint = Checkpoint(out_dir) if os.path.isdir(out_dir) else None
+    exported = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for conversation_id, turns in conversations.items():
+            if not turns or (checkpoint is not None and conversation_id in checkpoint.completed):
+                continue
+            exported += 1
+            request = build_request(conversation_id, turns)
+            f.write(json.dumps({
+                "custom_id": request.pop("custom_id"),
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": request,
+            }) + "\n")
+    return exported
+
+def import_batch(path: str, out_dir: str) -> Dict[str, int]:
+    os.makedirs(out_dir, exist_ok=True)
+    checkpoint = Checkpoint(out_dir)
+    counts = {"written": 0, "failed": 0}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            conversation_id = result["custom_id"]
+            try:
+                content = result["response"]["body"]["choices"][0]["message"]["content"]
+            except (KeyError, IndexError, TypeError):
+                counts["failed"] += 1
+                print(f"No briefing in batch output for {conversation_id}: {result.get('error')}")
+                continue
+            write_briefing(out_dir, conversation_id, content)
+            checkpoint.mark_done(conversation_id)
+            counts["written"] += 1
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate mediator briefings for completed conversations.")
+    parser.add_argument("--transcript-store",
+                        help="Transcript store to read conversations from: a SQLite path or a mongodb:// URI")
+    parser.add_argument("--index", help="Read conversations from this Pinecone index instead")
+    parser.add_argument("--local-index", help="Read conversations from a LocalIndex JSON file instead")
+    parser.add_argument("--metadata-store",
+                        help="Metadata store of an id-only index: a SQLite path or a mongodb:// URI")
+    parser.add_argument("--conversation-id", nargs="+", help="Only these conversations")
+    parser.add_argument("--idle-hours", type=float, default=24, help="Conversations idle this long are complete")
+    parser.add_argument("--out", default="briefings", help="Output directory (also holds the checkpoint)")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--requests-per-minute", type=float, default=60)
+    parser.add_argument("--tokens-per-minute", type=float, default=200000)
+    parser.add_argument("--fake", action="store_true", help="Use the offline fake client instead of OpenAI")
+    parser.add_argument("--export-batch", help="Write OpenAI Batch API requests here instead of calling the API")
+    parser.add_argument("--import-batch", help="Write briefings from an OpenAI Batch API output file")
+    args = parser.parse_args()
+
+    if args.import_batch:
+        print(import_batch(args.import_batch, args.out))
+        return
+
+    if args.transcript_store:
+        conversations = load_from_transcript_store(args.transcript_store, args.idle_hours)
+    elif args.local_index or args.index:
+        if args.local_index:
+            from local_index import LocalIndex
+            index = LocalIndex(args.local_index)
+        else:
+            from pinecone import Pinecone
+            index = Pinecone(api_key=os.environ["PINECONE_API_KEY"]).Index(args.index)
+        metadata_store = None
+        if args.metadata_store:
+            from metadata_store import open_metadata_store
+            metadata_store = open_metadata_store(args.metadata_store)
+        conversations = load_from_index(index, args.idle_hours, metadata_store)
+    else:
+        parser.error("one of --transcript-store, --index or --local-index is required")
+    if args.conversation_id:
+        conversations = {cid: turns for cid, turns in conversations.items() if cid in args.conversation_id}
+
+    if args.export_batch:
+        exported = export_batch(conversations, args.export_batch, args.out)
+        print(f"Wrote {exported} requests to {args.export_batch} "
+              f"({len(conversations) - exported} already briefed or empty)")
+        return
+
+    if args.fake:
+        from fake_services import FakeOpenAIClient
+        client = FakeOpenAIClient()
+    else:
+        from openai import OpenAI
+        client = OpenAI()
+    limiter = RateLimiter(args.requests_per_minute, args.tokens_per_minute)
+    print(generate_briefings(client, conversations, args.out, limiter, workers=args.workers))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Startup-time benchmark. Each measurement runs in a fresh interpreter so
+# nothing is already imported, which is what a new replica sees.
+#
+#   python bench_startup.py --repeat 5
+
+HEAVY_MODULES = ["streamlit", "openai", "pinecone", "tiktoken", "pymongo"]
+VARIANTS = ["ClaudeVersion_Nohistory.py", "BranchStreamlit7-2.py", "tempmain.py", "tempmain2.py"]
+
+def time_in_fresh_interpreter(code: str, repeat: int):
+    # Returns (median seconds, error); the snippet prints its own elapsed time
+    timings = []
+    for _ in range(repeat):
+        result = subprocess.run(
+            [sys.executable, "-c", code],
+            capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+            env={**os.environ, "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "bench-placeholder")}
+        )
+        if result.returncode != 0:
+            return None, (result.stderr.strip().splitlines() or ["failed"])[-1]
+        timings.append(float(result.stdout.strip().splitlines()[-1]))
+    return statistics.median(timings), None
+
+def bench_imports(repeat: int):
+    print("Import time of heavy modules (fresh interpreter, median):")
+    for module in HEAVY_MODULES:
+        seconds, error = time_in_fresh_interpreter(
+            f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)", repeat
+        )
+        print(f"  {module:<12} {'%8.1f ms' % (seconds * 1000) if error is None else 'n/a (' + error + ')'}")
+
+def bench_variants(repeat: int):
+    # Top-level execution of each app script up to main(), i.e. the work done
+    # on every script run before anything can render
+    print("App script top-level execution (fresh interpreter, median):")
+    for variant in VARIANTS:
+        seconds, error = time_in_fresh_interpreter(
+            "import time, runpy; t = time.perf_counter(); "
+            f"runpy.run_path({variant!r}, run_name='bench'); print(time.perf_counter() - t)",
+            repeat
+        )
+        print(f"  {variant:<28} {'%8.1f ms' % (seconds * 1000) if error is None else 'n/a (' + error + ')'}")
+
+WARMUP_SNIPPET = """
+import json, sys, time
+from replay_eval import load_variant
+variant = load_variant(sys.argv[1])
+started = time.perf_counter()
+warmup = variant["get_warm_resources"]()
+while not warmup.ready():
+    time.sleep(0.005)
+total_ms = (time.perf_counter() - started) * 1000
+errors = {}
+for name in warmup.builders:
+    try:
+        warmup.get(name)
+    except Exception as e:
+        errors[name] = f"{type(e).__name__}: {e}"
+print(json.dumps({"timings_ms": warmup.timings_ms, "errors": errors, "total_ms": total_ms}))
+"""
+
+def bench_warmup():
+    # Time until each app's own background warmup has its resources ready,
+    # i.e. how soon after the first page load a new replica can serve its
+    # first turn. Each variant runs in a fresh interpreter; without the app's
+    # secrets the builders fail and are reported as n/a.
+    print("Background warmup (fresh interpreter, each app's get_warm_resources):")
+    for variant in VARIANTS:
+        result = subprocess.run(
+            [sys.executable, "-c", WARMUP_SNIPPET, variant],
+            capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+        )
+        if result.returncode != 0:
+            print(f"  {variant:<28} n/a ({(result.stderr.strip().splitlines() or ['failed'])[-1]})")
+            continue
+        report = json.loads(result.stdout.strip().splitlines()[-1])
+        print(f"  {variant}")
+        for name, ms in report["timings_ms"].items():
+            print(f"    {name:<24} {ms:8.1f} ms")
+        for name, error in report["errors"].items():
+            print(f"    {name:<24} n/a ({error})")
+        if not report["errors"]:
+            print(f"    {'all ready':<24} {report['total_ms']:8.1f} ms (built in parallel)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cold-start cost of the app variants.")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    bench_imports(args.repeat)
+    bench_variants(args.repeat)
+    bench_warmup()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+import argparse
+import math
+import os
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Callable, Dict, List
+
+from token_utils import truncate_to_tokens
+
+# Rolls closed conversations in the mediation4 index up into a few summary
+# vectors each, deletes the per-message vectors and enforces a retention TTL.
+#
+#   python compact_conversations.py --local-index index.json --dry-run
+#   python compact_conversations.py --index mediation4 --idle-hours 48 --retention-days 365
+
+CONVERSATION_PREFIX = "conversation_"
+SUMMARY_TYPE = "conversation_summary"
+FETCH_BATCH_SIZE = 100
+# Pinecone accepts at most 1000 ids per delete call
+DELETE_BATCH_SIZE = 1000
+
+@dataclass
+class CompactionReport:
+    vectors_before: int = 0
+    vectors_after: int = 0
+    conversations_compacted: int = 0
+    conversations_active: int = 0
+    message_vectors_deleted: int = 0
+    summary_vectors_written: int = 0
+    summaries_expired: int = 0
+    # Left alone because their text could not be read (id-only index without
+    # its metadata store) or their turns carry no position to order them by
+    conversations_skipped: int = 0
+
+def vector_count(index) -> int:
+    return index.describe_index_stats()["total_vector_count"]
+
+def batched(items: List, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def fetch_conversation_vectors(index, metadata_store=None) -> Dict[str, Dict]:
+    vectors = {}
+    for page in index.list(prefix=CONVERSATION_PREFIX):
+        for batch in batched(list(page), FETCH_BATCH_SIZE):
+            for vector_id, vector in index.fetch(ids=batch)["vectors"].items():
+                vectors[vector_id] = {
+                    "values": list(vector.get("values") or []),
+                    "metadata": dict(vector.get("metadata") or {}),
+                }
+    if metadata_store is not None:
+        # Id-only indexes keep the text in the side store
+        for vector_id, metadata in metadata_store.get_many(list(vectors)).items():
+            vectors[vector_id]["metadata"] = {**metadata, **vectors[vector_id]["metadata"]}
+    return vectors
+
+def group_by_conversation(vectors: Dict[str, Dict]) -> Dict[str, Dict[str, List]]:
+    groups = defaultdict(lambda: {"messages": [], "summaries": []})
+    for vector_id, vector in vectors.items():
+        metadata = vector["metadata"]
+        conversation_id = metadata.get("conversation_id")
+        if not conversation_id:
+            continue
+        kind = "summaries" if metadata.get("type") == SUMMARY_TYPE else "messages"
+        groups[conversation_id][kind].append((vector_id, vector))
+    return groups
+
+def has_turn_order(items: List) -> bool:
+    # Vectors written before turns carried a position cannot be put back in
+    # order: user and assistant turns share a created_at second, or have none
+    return all(vector["metadata"].get("position") is not None for _, vector in items)
+
+def reassemble_turns(items: List) -> List[Dict]:
+    # Long turns are stored as chunk vectors sharing a parent_id; merge them
+    # back into one turn (metadata plus all chunk vectors) in conversation order.
+    # Chunks keep their trailing whitespace, so joining them restores the text.
+    # Callers check has_turn_order first.
+    turns = {}
+    ordered = sorted(
+        items,
+        key=lambda item: (item[1]["metadata"]["position"], item[1]["metadata"].get("chunk_index", 0))
+    )
+    for vector_id, vector in ordered:
+        metadata = vector["metadata"]
+        parent_id = metadata.get("parent_id") or vector_id
+        if parent_id in turns:
+            turn = turns[parent_id]
+            turn["metadata"]["snippet"] = turn["metadata"].get("snippet", "") + metadata.get("snippet", "")
+            turn["vectors"].append(vector["values"])
+        else:
+            turns[parent_id] = {"metadata": dict(metadata), "vectors": [vector["values"]]}
+    return list(turns.values())
+
+def extractive_summary(turns: List[Dict], max_tokens: int = 400) -> str:
+    # Offline default: keep the opening of each turn so the summary still covers
+    # the whole span of the conversation
+    per_turn = max(16, max_tokens // max(1, len(turns)))
+    return "\n".join(
+        f"{turn.get('role', 'unknown').title()}: {truncate_to_tokens(turn.get('snippet', ''), per_turn)}"
+        for turn in turns
+    )
+
+class OpenAISummarizer:
+    def __init__(self, client, model: str = "gpt-4o-mini"):
+        self.client = client
+        self.model = model
+
+    def __call__(self, turns: List[Dict]) -> str:
+        transcript = "\n".join(f"{turn.get('role', 'unknown').title()}: {turn.get('snippet', '')}" for turn in turns)
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": (
+                    "Summarize this excerpt of a family mediation intake conversation. Keep names, "
+                    "children, assets, issues raised and the user's stated goals and concerns."
+                )},
+                {"role": "user", "content": transcript},
+            ],
+            temperature=0.2
+        )
+        return response.choices[0].message.content
+
+def centroid(vectors: List[List[float]]) -> List[float]:
+    dimension = len(vectors[0])
+    mean = [sum(vector[i] for vector in vectors) / len(vectors) for i in range(dimension)]
+    norm = math.sqrt(sum(x * x for x in mean)) or 1.0
+    return [x / norm for x in mean]
+
+def compact(index, idle_hours: float = 24, retention_days: float = 365, turns_per_summary: int = 20,
+            summarize: Callable = extractive_summary, embed: Callable = None,
+            metadata_store=None, dry_run: bool = False, now: float = None) -> CompactionReport:
+    now = now if now is not None else time.time()
+    idle_cutoff = now - idle_hours * 3600
+    retention_cutoff = now - retention_days * 86400
+    report = CompactionReport(vectors_before=vector_count(index))
+
+    groups = group_by_conversation(fetch_conversation_vectors(index, metadata_store))
+    to_delete, to_upsert, side_records = [], [], {}
+    for conversation_id, group in groups.items():
+        # Vectors written before created_at existed have an unknown age; they
+        # are summarized once closed but never expired by retention
+        expired = [
+            vector_id for vector_id, vector in group["summaries"]
+            if vector["metadata"].get("created_at") is not None
+            and vector["metadata"]["created_at"] < retention_cutoff
+        ]
+        to_delete.extend(expired)
+        report.summaries_expired += len(expired)
+
+        messages = group["messages"]
+        if not messages:
+            continue
+        timestamps = [
+            vector["metadata"]["created_at"] for _, vector in messages
+            if vector["metadata"].get("created_at") is not None
+        ]
+        last_activity = max(timestamps) if timestamps else None
+        if last_activity is not None and last_activity >= idle_cutoff:
+            report.conversations_active += 1
+            continue
+        if any(not vector["metadata"].get("snippet") for _, vector in messages):
+            # Deleting turns whose text we cannot read would lose it for good
+            report.conversations_skipped += 1
+            continue
+        expired_conversation = last_activity is not None and last_activity < retention_cutoff
+        if not expired_conversation and not has_turn_order(messages):
+            # A summary of turns in a made-up order would replace the real ones
+            report.conversations_skipped += 1
+            continue
+
+        report.conversations_compacted += 1
+        to_delete.extend(vector_id for vector_id, _ in messages)
+        if expired_conversation:
+            # Past retention already; nothing worth summarizing
+            continue
+        first_part = 1 + max(
+            (int(vector_id.rsplit("_", 1)[1]) for vector_id, _ in group["summaries"]), default=-1
+        )
+        for part, chunk in enumerate(batched(reassemble_turns(messages), turns_per_summary), start=first_part):
+            turns = [turn["metadata"] for turn in chunk]
+            summary = summarize(turns)
+            values = embed(summary) if embed else centroid([values for turn in chunk for values in turn["vectors"]])
+            summary_id = f"{CONVERSATION_PREFIX}{conversation_id}_summary_{part}"
+            metadata = {
+                "conversation_id": conversation_id,
+                "type": SUMMARY_TYPE,
+                "snippet": summary,
+                "turn_count": len(turns),
+            }
+            created_at = max((turn["created_at"] for turn in turns if turn.get("created_at") is not None), default=None)
+            if created_at is not None:
+                metadata["created_at"] = created_at
+            if metadata_store is not None:
+                side_records[summary_id] = metadata
+                metadata = {key: metadata[key] for key in ("conversation_id", "type", "created_at") if key in metadata}
+            to_upsert.append((summary_id, values, metadata))
+
+    report.summary_vectors_written = len(to_upsert)
+    report.message_vectors_deleted = len(to_delete) - report.summaries_expired
+    if dry_run:
+        report.vectors_after = report.vectors_before + len(to_upsert) - len(to_delete)
+        return report
+
+    # Write summaries before deleting anything so an interrupted run loses nothing
+    if side_records:
+        metadata_store.put_many(side_records)
+    for batch in batched(to_upsert, FETCH_BATCH_SIZE):
+        index.upsert(vectors=batch)
+    for batch in batched(to_delete, DELETE_BATCH_SIZE):
+        index.delete(ids=batch)
+        if metadata_store is not None:
+            metadata_store.delete_many(batch)
+    report.vectors_after = vector_count(index)
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact conversation vectors in the mediation index.")
+    parser.add_argument("--index", default="mediation4", help="Pinecone index name")
+    parser.add_argument("--local-index", help="Run against a LocalIndex JSON file instead of Pinecone")
+    parser.add_argument("--metadata-store",
+                        help="Metadata store used by id-only indexes: a SQLite path or a mongodb:// URI")
+    parser.add_argument("--idle-hours", type=float, default=24, help="Conversations idle this long are closed")
+    parser.add_argument("--retention-days", type=float, default=365, help="Delete anything older than this")
+    parser.add_argument("--turns-per-summary", type=int, default=20)
+    parser.add_argument("--summarizer", choices=["extractive", "openai"], default="extractive")
+    parser.add_argument("--embed-summaries", action="store_true",
+                        help="Embed summary text with OpenAI instead of averaging the turn vectors")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    if args.local_index:
+        from local_index import LocalIndex
+        index = LocalIndex(args.local_index)
+    else:
+        from pinecone import Pinecone
+        index = Pinecone(api_key=os.environ["PINECONE_API_KEY"]).Index(args.index)
+
+    metadata_store = None
+    if args.metadata_store:
+        from metadata_store import open_metadata_store
+        metadata_store = open_metadata_store(args.metadata_store)
+
+    summarize, embed = extractive_summary, None
+    if args.summarizer == "openai" or args.embed_summaries:
+        from openai import OpenAI
+        client = OpenAI()
+        if args.summarizer == "openai":
+            summarize = OpenAISummarizer(client)
+        if args.embed_summaries:
+            embed = lambda text: client.embeddings.create(
+                model="text-embedding-3-large", input=text
+            ).data[0].embedding
+
+    report = compact(
+        index,
+        idle_hours=args.idle_hours,
+        retention_days=args.retention_days,
+        turns_per_summary=args.turns_per_summary,
+        summarize=summarize,
+        embed=embed,
+        metadata_store=metadata_store,
+        dry_run=args.dry_run,
+    )
+    if args.local_index and not args.dry_run:
+        index.save()
+
+    print(f"Index size before: {report.vectors_before}")
+    print(f"Index size after:  {report.vectors_after}{' (projected)' if args.dry_run else ''}")
+    print(f"Conversations compacted: {report.conversations_compacted} "
+          f"(still active: {report.conversations_active})")
+    if report.conversations_skipped:
+        print(f"Conversations skipped, no text or turn order to summarize: {report.conversations_skipped} "
+              f"(id-only index? pass --metadata-store; turns stored before positions existed are kept)")
+    print(f"Message vectors deleted: {report.message_vectors_deleted}")
+    print(f"Summary vectors written: {report.summary_vectors_written}")
+    print(f"Expired summaries deleted: {report.summaries_expired}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import hashlib
+import math
+import re
+import threading
+import time
+from types import SimpleNamespace
+from typing import Dict, List
+
+from token_utils import count_tokens
+
+# Offline stand-in for the OpenAI client used by the app variants. It answers
+# with recorded replies where available, embeds text with a hashed bag of words
+# (so similar texts land near each other), and logs token usage and the latency
+# the real service would have added according to MODEL_CONFIGS. With
+# simulate_latency it also sleeps for that long, so deadline logic in the app
+# sees realistic timings.
+
+EMBEDDING_DIMENSION = 64
+
+def fake_embedding(text: str, dimension: int = EMBEDDING_DIMENSION) -> List[float]:
+    vector = [0.0] * dimension
+    for word in re.findall(r"[a-z']+", text.lower()):
+        bucket = int(hashlib.md5(word.encode("utf-8")).hexdigest(), 16) % dimension
+        vector[bucket] += 1.0
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+class FakeOpenAIClient:
+    def __init__(self, model_configs: Dict = None, recorded_replies: List[str] = None,
+                 model_override: str = None, dimension: int = EMBEDDING_DIMENSION,
+                 simulate_latency: bool = False):
+        self.model_configs = model_configs or {}
+        self.recorded_replies = list(recorded_replies or [])
+        self.model_override = model_override
+        self.dimension = dimension
+        self.simulate_latency = simulate_latency
+        self.calls = []
+        self._lock = threading.Lock()
+        self.embeddings = SimpleNamespace(create=self._create_embedding)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create_completion))
+
+    def with_options(self, **options):
+        # Per-request retry and timeout settings have nothing to change offline
+        return self
+
+    def _simulated_ms(self, model: str, output_tokens: int) -> float:
+        config = self.model_configs.get(model)
+        if config is None:
+            return 0.0
+        return config.latency_ms + output_tokens / config.tokens_per_second * 1000
+
+    def _first_token_ms(self, model: str) -> float:
+        config = self.model_configs.get(model)
+        return config.latency_ms if config is not None else 0.0
+
+    def _record(self, call: Dict):
+        # Calls made by background threads (intake extraction, prefetch) are
+        # tagged so replays can keep them out of the user-visible latency
+        call["thread"] = threading.current_thread().name
+        with self._lock:
+            self.calls.append(call)
+
+    def _sleep(self, ms: float):
+        if self.simulate_latency and ms > 0:
+            time.sleep(ms / 1000)
+
+    def _create_embedding(self, model: str, input, **kwargs):
+        texts = [input] if isinstance(input, str) else list(input)
+        tokens = sum(count_tokens(text) for text in texts)
+        self._record({
+            "kind": "embedding", "model": model, "prompt_tokens": tokens,
+            "completion_tokens": 0, "simulated_ms": self._simulated_ms(model, 0),
+        })
+        self._sleep(self._simulated_ms(model, 0))
+        return SimpleNamespace(
+            data=[SimpleNamespace(embedding=fake_embedding(text, self.dimension), index=i) for i, text in enumerate(texts)],
+            usage=SimpleNamespace(prompt_tokens=tokens, total_tokens=tokens)
+        )
+
+    def _create_completion(self, model: str, messages: List[Dict], **kwargs):
+        model = self.model_override or model
+        if kwargs.get("response_format", {}).get("type") == "json_object":
+            content = "{}"
+        elif self.recorded_replies:
+            content = self.recorded_replies.pop(0)
+        else:
+            last_user = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+            content = f"Thank you for sharing that. Could you tell me a little more about {last_user[:80]}?"
+        prompt_tokens = sum(count_tokens(message["content"]) for message in messages)
+        completion_tokens = count_tokens(content)
+        self._record({
+            "kind": "chat", "model": model, "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens, "stream": bool(kwargs.get("stream")),
+            "simulated_ms": self._simulated_ms(model, completion_tokens),
+            "first_token_ms": self._first_token_ms(model),
+            "messages": messages,
+        })
+        if kwargs.get("stream"):
+            return self._stream(model, content, completion_tokens)
+        self._sleep(self._simulated_ms(model, completion_tokens))
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+            usage=SimpleNamespace(
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                total_tokens=prompt_tokens + completion_tokens
+            )
+        )
+
+    def _stream(self, model: str, content: str, completion_tokens: int):
+        self._sleep(self._first_token_ms(model))
+        pieces = re.findall(r"\S+\s*", content) or [content]
+        per_piece_ms = (self._simulated_ms(model, completion_tokens) - self._first_token_ms(model)) / len(pieces)
+        for position, piece in enumerate(pieces):
+            if position:
+                self._sleep(per_piece_ms)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))])
@@ -0,0 +1,181 @@
+import copy
+import json
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+# Structured record of where an intake stands, updated incrementally after each
+# turn by a cheap model running off the critical path. The record goes into the
+# prompt as one compact block so the response model no longer needs the whole
+# transcript to know what has been covered.
+
+ISSUE_STATUSES = ("raised", "exploring", "summarized", "resolved")
+
+EXTRACTION_PROMPT = """You maintain a structured record of a family mediation intake conversation.
+Given the current record (JSON) and the newest conversation turns, return a JSON object containing
+ONLY the fields that should change. Fields:
+  user_name, spouse_name, marriage_history, living_arrangement, legal_status: short strings
+  children: full list of {"name", "age", "special_needs"}
+  assets, debts: full lists of short strings
+  issues: full list of {"topic", "status"} with status one of raised, exploring, summarized, resolved
+  current_issue: topic currently being discussed, or null
+Only record facts the user actually stated. Return {} if nothing changed."""
+
+# One shared pool per server process; extraction never blocks a reply
+_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="intake")
+
+@dataclass
+class Child:
+    name: str = ""
+    age: str = ""
+    special_needs: str = ""
+
+@dataclass
+class Issue:
+    topic: str
+    status: str = "raised"
+
+@dataclass
+class IntakeRecord:
+    user_name: str = ""
+    spouse_name: str = ""
+    marriage_history: str = ""
+    living_arrangement: str = ""
+    legal_status: str = ""
+    children: List[Child] = field(default_factory=list)
+    assets: List[str] = field(default_factory=list)
+    debts: List[str] = field(default_factory=list)
+    issues: List[Issue] = field(default_factory=list)
+    current_issue: Optional[str] = None
+    turns_processed: int = 0
+
+    @property
+    def issues_discussed(self) -> List[str]:
+        return [issue.topic for issue in self.issues if issue.status != "raised"]
+
+    def merged(self, update: Dict) -> "IntakeRecord":
+        record = copy.deepcopy(self)
+        for key in ("user_name", "spouse_name", "marriage_history", "living_arrangement", "legal_status"):
+            if isinstance(update.get(key), str):
+                setattr(record, key, update[key].strip())
+        if "current_issue" in update:
+            record.current_issue = update["current_issue"] or None
+        if isinstance(update.get("children"), list):
+            record.children = [
+                Child(**{key: str(child.get(key, "")) for key in ("name", "age", "special_needs")})
+                for child in update["children"] if isinstance(child, dict)
+            ]
+        for key in ("assets", "debts"):
+            if isinstance(update.get(key), list):
+                setattr(record, key, [str(item) for item in update[key]])
+        if isinstance(update.get("issues"), list):
+            record.issues = [
+                Issue(str(issue["topic"]), issue.get("status") if issue.get("status") in ISSUE_STATUSES else "raised")
+                for issue in update["issues"] if isinstance(issue, dict) and issue.get("topic")
+            ]
+        return record
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+    def to_prompt_block(self) -> str:
+        lines = []
+        if self.user_name:
+            lines.append(f"User: {self.user_name}")
+        if self.spouse_name:
+            lines.append(f"Spouse: {self.spouse_name}")
+        if self.marriage_history:
+            lines.append(f"Marriage: {self.marriage_history}")
+        if self.living_arrangement:
+            lines.append(f"Living arrangement: {self.living_arrangement}")
+        if self.legal_status:
+            lines.append(f"Legal status: {self.legal_status}")
+        if self.children:
+            lines.append("Children: " + "; ".join(
+                ", ".join(part for part in (child.name, child.age, child.special_needs) if part)
+                for child in self.children
+            ))
+        if self.assets:
+            lines.append("Assets: " + "; ".join(self.assets))
+        if self.debts:
+            lines.append("Debts: " + "; ".join(self.debts))
+        if self.issues:
+            lines.append("Issues: " + "; ".join(f"{issue.topic} ({issue.status})" for issue in self.issues))
+        if self.current_issue:
+            lines.append(f"Currently discussing: {self.current_issue}")
+        if not lines:
+            return ""
+        return "Intake so far (earlier turns may be omitted):\n" + "\n".join(lines)
+
+class IntakeExtractor:
+    def __init__(self, client, model: str = "gpt-4o-mini"):
+        self.client = client
+        self.model = model
+
+    def extract(self, record: IntakeRecord, turns: List[Tuple[str, str]]) -> IntakeRecord:
+        transcript = "\n".join(f"User: {user}\nAssistant: {assistant}" for user, assistant in turns)
+        try:
+            response = self.client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": EXTRACTION_PROMPT},
+                    {"role": "user", "content": (
+                        f"Current record:\n{json.dumps(record.to_dict())}\n\nNewest turns:\n{transcript}"
+                    )},
+                ],
+                response_format={"type": "json_object"},
+                temperature=0
+            )
+            update = json.loads(response.choices[0].message.content or "{}")
+        except Exception as e:
+            print(f"Error in intake extraction: {str(e)}")
+            return record
+        if not isinstance(update, dict):
+            print(f"Error in intake extraction: expected a JSON object, got {type(update).__name__}")
+            return record
+        # Turns only count as covered once their delta has been applied
+        updated = record.merged(update)
+        updated.turns_processed = record.turns_processed + len(turns)
+        return updated
+
+    def submit(self, record: IntakeRecord, turns: List[Tuple[str, str]]) -> Future:
+        return _EXECUTOR.submit(self.extract, record, turns)
+
+class IntakeTracker:
+    # Lives in st.session_state. At most one extraction runs per session; turns
+    # that arrive meanwhile are queued and sent together in the next one. Turns
+    # from a failed extraction go back on the queue.
+    def __init__(self, extractor: IntakeExtractor):
+        self.extractor = extractor
+        self.record = IntakeRecord()
+        self._future = None
+        self._in_flight = []
+        self._pending = []
+
+    def observe_turn(self, user_text: str, assistant_text: str):
+        self._pending.append((user_text, assistant_text))
+        self._collect()
+
+    def current(self) -> IntakeRecord:
+        self._collect()
+        return self.record
+
+    def drain(self):
+        # Block until no extraction is running; turns from a failed one stay
+        # queued instead of being retried here
+        while self._future is not None:
+            wait([self._future])
+            failed = self._future.result().turns_processed <= self.record.turns_processed
+            self._collect(submit=not failed)
+
+    def _collect(self, submit: bool = True):
+        if self._future is not None and self._future.done():
+            record = self._future.result()
+            if record.turns_processed > self.record.turns_processed:
+                self.record = record
+            else:
+                self._pending = self._in_flight + self._pending
+            self._future, self._in_flight = None, []
+        if submit and self._future is None and self._pending:
+            self._in_flight, self._pending = self._pending, []
+            self._future = self.extractor.submit(self.record, self._in_flight)
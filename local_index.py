@@ -0,0 +1,120 @@
+import json
+import math
+import os
+import threading
+from typing import Dict, Iterator, List
+
+# In-memory stand-in for a Pinecone index, for offline jobs and replay runs.
+# Responses are plain dicts shaped like the Pinecone client's, so code written
+# against `results["matches"]` / `match.get("metadata")` works unchanged.
+
+def _cosine(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+def _matches_filter(metadata: Dict, filter: Dict) -> bool:
+    # Supports the equality, $eq, $in and $lt/$lte/$gt/$gte forms used in this repo
+    for key, condition in (filter or {}).items():
+        value = metadata.get(key)
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for op, operand in condition.items():
+            if op == "$eq" and value != operand:
+                return False
+            if op == "$ne" and value == operand:
+                return False
+            if op == "$in" and value not in operand:
+                return False
+            if op in ("$lt", "$lte", "$gt", "$gte"):
+                if value is None:
+                    return False
+                if op == "$lt" and not value < operand:
+                    return False
+                if op == "$lte" and not value <= operand:
+                    return False
+                if op == "$gt" and not value > operand:
+                    return False
+                if op == "$gte" and not value >= operand:
+                    return False
+    return True
+
+class LocalIndex:
+    def __init__(self, path: str = None):
+        self.path = path
+        self._vectors = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self._vectors = json.load(f)
+
+    def save(self):
+        if self.path:
+            with self._lock, open(self.path, "w") as f:
+                json.dump(self._vectors, f)
+
+    def upsert(self, vectors: List, **kwargs):
+        with self._lock:
+            for vector in vectors:
+                if isinstance(vector, dict):
+                    vector_id, values, metadata = vector["id"], vector["values"], vector.get("metadata")
+                else:
+                    vector_id, values, metadata = (tuple(vector) + (None,))[:3]
+                self._vectors[vector_id] = {"values": list(values), "metadata": dict(metadata or {})}
+        return {"upserted_count": len(vectors)}
+
+    def query(self, vector: List[float], top_k: int = 10, include_metadata: bool = False,
+              include_values: bool = False, filter: Dict = None, **kwargs):
+        with self._lock:
+            scored = [
+                (_cosine(vector, record["values"]), vector_id, record)
+                for vector_id, record in self._vectors.items()
+                if _matches_filter(record["metadata"], filter)
+            ]
+        scored.sort(key=lambda item: item[0], reverse=True)
+        matches = []
+        for score, vector_id, record in scored[:top_k]:
+            match = {"id": vector_id, "score": score}
+            if include_values:
+                match["values"] = record["values"]
+            if include_metadata:
+                match["metadata"] = dict(record["metadata"])
+            matches.append(match)
+        return {"matches": matches}
+
+    def fetch(self, ids: List[str], **kwargs):
+        with self._lock:
+            return {
+                "vectors": {
+                    vector_id: {
+                        "id": vector_id,
+                        "values": self._vectors[vector_id]["values"],
+                        "metadata": dict(self._vectors[vector_id]["metadata"]),
+                    }
+                    for vector_id in ids
+                    if vector_id in self._vectors
+                }
+            }
+
+    def delete(self, ids: List[str] = None, filter: Dict = None, **kwargs):
+        with self._lock:
+            if ids is not None:
+                for vector_id in ids:
+                    self._vectors.pop(vector_id, None)
+            if filter is not None:
+                for vector_id in [
+                    vector_id for vector_id, record in self._vectors.items()
+                    if _matches_filter(record["metadata"], filter)
+                ]:
+                    del self._vectors[vector_id]
+        return {}
+
+    def list(self, prefix: str = "", limit: int = 100, **kwargs) -> Iterator[List[str]]:
+        with self._lock:
+            ids = sorted(vector_id for vector_id in self._vectors if vector_id.startswith(prefix))
+        for start in range(0, len(ids), limit):
+            yield ids[start:start + limit]
+
+    def describe_index_stats(self, **kwargs):
+        with self._lock:
+            return {"total_vector_count": len(self._vectors)}
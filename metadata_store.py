@@ -0,0 +1,148 @@
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Tuple
+
+# Fields small enough to keep in the vector index so queries can still filter
+# on them; everything else lives only in the side store
+INDEX_METADATA_FIELDS = (
+    "conversation_id", "role", "type", "user_id", "created_at", "position", "parent_id", "chunk_index",
+    "category1", "category2", "priority"
+)
+
+def split_metadata(metadata: Dict) -> Tuple[Dict, Dict]:
+    index_metadata = {key: value for key, value in metadata.items() if key in INDEX_METADATA_FIELDS}
+    return index_metadata, metadata
+
+class LocalMetadataStore:
+    def __init__(self, path: str = "metadata_store.db"):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS records (id TEXT PRIMARY KEY, metadata TEXT NOT NULL)"
+        )
+        self._conn.commit()
+
+    def put_many(self, records: Dict[str, Dict]):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO records (id, metadata) VALUES (?, ?)",
+                [(record_id, json.dumps(metadata)) for record_id, metadata in records.items()]
+            )
+            self._conn.commit()
+
+    def get_many(self, ids: Iterable[str]) -> Dict[str, Dict]:
+        ids = list(ids)
+        if not ids:
+            return {}
+        placeholders = ",".join("?" * len(ids))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id, metadata FROM records WHERE id IN ({placeholders})", ids
+            ).fetchall()
+        return {record_id: json.loads(metadata) for record_id, metadata in rows}
+
+    def delete_many(self, ids: Iterable[str]):
+        with self._lock:
+            self._conn.executemany("DELETE FROM records WHERE id = ?", [(record_id,) for record_id in ids])
+            self._conn.commit()
+
+class MongoMetadataStore:
+    def __init__(self, uri: str, database: str = "mediation", collection: str = "vector_metadata"):
+        from pymongo import MongoClient
+        self._collection = MongoClient(uri)[database][collection]
+
+    def put_many(self, records: Dict[str, Dict]):
+        from pymongo import ReplaceOne
+        if records:
+            self._collection.bulk_write([
+                ReplaceOne({"_id": record_id}, {"_id": record_id, "metadata": metadata}, upsert=True)
+                for record_id, metadata in records.items()
+            ])
+
+    def get_many(self, ids: Iterable[str]) -> Dict[str, Dict]:
+        return {
+            document["_id"]: document["metadata"]
+            for document in self._collection.find({"_id": {"$in": list(ids)}})
+        }
+
+    def delete_many(self, ids: Iterable[str]):
+        self._collection.delete_many({"_id": {"$in": list(ids)}})
+
+def open_metadata_store(location: str):
+    # Offline jobs name the store the app uses: a mongodb:// URI or a SQLite path
+    if location.startswith(("mongodb://", "mongodb+srv://")):
+        return MongoMetadataStore(location)
+    return LocalMetadataStore(location)
+
+class CachedMetadataStore:
+    # LRU cache in front of another store; writes go through to both
+    def __init__(self, store, max_entries: int = 4096):
+        self.store = store
+        self.max_entries = max_entries
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, record_id: str, metadata: Dict):
+        self._cache[record_id] = metadata
+        self._cache.move_to_end(record_id)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    def put_many(self, records: Dict[str, Dict]):
+        self.store.put_many(records)
+        with self._lock:
+            for record_id, metadata in records.items():
+                self._remember(record_id, metadata)
+
+    def get_many(self, ids: Iterable[str]) -> Dict[str, Dict]:
+        found, missing = {}, []
+        with self._lock:
+            for record_id in ids:
+                if record_id in self._cache:
+                    self._cache.move_to_end(record_id)
+                    found[record_id] = self._cache[record_id]
+                else:
+                    missing.append(record_id)
+        if missing:
+            loaded = self.store.get_many(missing)
+            with self._lock:
+                for record_id, metadata in loaded.items():
+                    self._remember(record_id, metadata)
+            found.update(loaded)
+        return found
+
+    def delete_many(self, ids: Iterable[str]):
+        ids = list(ids)
+        self.store.delete_many(ids)
+        with self._lock:
+            for record_id in ids:
+                self._cache.pop(record_id, None)
+
+def hydrate_matches(matches: List, metadata_store, pinecone_index, fetch_missing: bool = True) -> List[Dict]:
+    # Fill in metadata for id-only query results. Ids the store has never seen
+    # (e.g. corpus documents loaded before the store existed) are fetched from
+    # the index once and written back, unless the caller has no time for the
+    # extra round trip; those matches are then left without metadata.
+    ids = [match.get("id") for match in matches]
+    records = metadata_store.get_many(ids)
+    missing = [record_id for record_id in ids if record_id not in records]
+    if missing and fetch_missing:
+        fetched = pinecone_index.fetch(ids=missing)["vectors"]
+        backfill = {
+            record_id: dict(vector.get("metadata") or {})
+            for record_id, vector in fetched.items()
+        }
+        if backfill:
+            metadata_store.put_many(backfill)
+            records.update(backfill)
+    return [
+        {
+            "id": match.get("id"),
+            "score": match.get("score"),
+            "values": match.get("values"),
+            "metadata": records.get(match.get("id"), {}),
+        }
+        for match in matches
+    ]
@@ -0,0 +1,106 @@
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from enum import Enum
+from typing import Callable, Dict, Optional
+
+# The intake in SYSTEM_MESSAGE walks through a fixed sequence of topics. Once a
+# reply is on screen, the user spends several seconds typing; the prefetcher
+# uses that time to run corpus retrieval for the current and next phase, so a
+# turn that moves into a new phase finds its context already cached.
+
+class IntakePhase(Enum):
+    NAMES = "names"
+    MARRIAGE_HISTORY = "marriage_history"
+    LIVING_ARRANGEMENTS = "living_arrangements"
+    CHILDREN = "children"
+    FINANCES = "finances"
+    EMOTIONAL_GOALS = "emotional_goals"
+
+PHASE_ORDER = list(IntakePhase)
+
+# Whole words or phrases in the assistant's latest question that place the
+# intake in a phase; a trailing * matches any word starting with the stem
+PHASE_KEYWORDS = {
+    IntakePhase.NAMES: ["first name", "your name", "spouse's name", "spouse’s name"],
+    IntakePhase.MARRIAGE_HISTORY: ["married", "marriage", "met", "separat*", "timeline", "attorney*", "filed"],
+    IntakePhase.LIVING_ARRANGEMENTS: ["living arrangement*", "live", "lives", "living", "moved out", "move out"],
+    IntakePhase.CHILDREN: ["child", "children", "kids", "custody", "parenting", "visitation"],
+    IntakePhase.FINANCES: ["asset*", "debt*", "financ*", "home", "house", "retirement", "account*", "support", "propert*"],
+    IntakePhase.EMOTIONAL_GOALS: ["feel*", "fear*", "hope*", "goal*", "outcome*", "emotional", "worr*"],
+}
+
+# Empathetic wording turns up in questions about any topic, so these terms
+# count for less than the topic words they appear next to
+GENERIC_KEYWORDS = {"feel*", "fear*", "hope*", "worr*"}
+GENERIC_KEYWORD_WEIGHT = 0.3
+
+def _keyword_pattern(keyword: str):
+    if keyword.endswith("*"):
+        return re.compile(r"\b" + re.escape(keyword[:-1]) + r"\w*\b")
+    return re.compile(r"\b" + re.escape(keyword) + r"\b")
+
+PHASE_PATTERNS = {
+    phase: [
+        (_keyword_pattern(keyword), GENERIC_KEYWORD_WEIGHT if keyword in GENERIC_KEYWORDS else 1.0)
+        for keyword in keywords
+    ]
+    for phase, keywords in PHASE_KEYWORDS.items()
+}
+
+# Retrieval queries standing in for the user's not-yet-typed answer
+PHASE_QUERIES = {
+    IntakePhase.NAMES: "introductions, first names of the client and spouse, starting mediation",
+    IntakePhase.MARRIAGE_HISTORY: "history of the marriage, how long married, timeline leading to separation, legal actions",
+    IntakePhase.LIVING_ARRANGEMENTS: "current living arrangements after separation, who lives where, temporary agreements",
+    IntakePhase.CHILDREN: "children, custody and visitation, parenting plan, best interests of the child in California",
+    IntakePhase.FINANCES: "division of community property, family home, retirement accounts, debts, spousal and child support",
+    IntakePhase.EMOTIONAL_GOALS: "emotional concerns, fears and hopes, goals for a successful mediation outcome",
+}
+
+_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="prefetch")
+
+def detect_phase(assistant_text: str, previous: IntakePhase = IntakePhase.NAMES) -> IntakePhase:
+    text = (assistant_text or "").lower()
+    # The question being asked is usually in the last sentence or two
+    tail = " ".join(re.split(r"(?<=[.?!])\s+", text)[-2:])
+    scores = {
+        phase: sum(weight * len(pattern.findall(tail)) for pattern, weight in patterns)
+        for phase, patterns in PHASE_PATTERNS.items()
+    }
+    best = max(PHASE_ORDER, key=lambda phase: scores[phase])
+    return best if scores[best] > 0 else previous
+
+def next_phase(phase: IntakePhase) -> Optional[IntakePhase]:
+    position = PHASE_ORDER.index(phase)
+    return PHASE_ORDER[position + 1] if position + 1 < len(PHASE_ORDER) else None
+
+class PhasePrefetcher:
+    # Per-session cache of phase -> (expires_at, future)
+    def __init__(self, ttl_seconds: float = 300):
+        self.ttl_seconds = ttl_seconds
+        self._cache: Dict[IntakePhase, tuple] = {}
+
+    def prefetch(self, phase: IntakePhase, retrieve: Callable[[str], str]):
+        cached = self._cache.get(phase)
+        if cached is not None and cached[0] > time.monotonic():
+            return
+        future = _EXECUTOR.submit(retrieve, PHASE_QUERIES[phase])
+        self._cache[phase] = (time.monotonic() + self.ttl_seconds, future)
+
+    def drain(self):
+        # Block until every prefetch started so far has finished
+        wait([future for _, future in self._cache.values()])
+
+    def take(self, phase: IntakePhase) -> Optional[str]:
+        # Never waits: a prefetch still in flight counts as a miss
+        cached = self._cache.get(phase)
+        if cached is None:
+            return None
+        expires_at, future = cached
+        if expires_at <= time.monotonic():
+            del self._cache[phase]
+            return None
+        if not future.done() or future.exception() is not None:
+            return None
+        return future.result()
@@ -0,0 +1,316 @@
+import argparse
+import ast
+import inspect
+import itertools
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List
+
+from fake_services import FakeOpenAIClient, fake_embedding
+from local_index import LocalIndex
+from transcript_store import LocalTranscriptStore
+
+# Replays recorded user transcripts through each app variant's own turn
+# function (handle_turn, the code main() runs) against fake services, and
+# compares latency, tokens, cost and retrieval hits per variant and
+# MODEL_CONFIGS entry.
+#
+#   python replay_eval.py transcripts.jsonl --models gpt-4o gpt-4o-mini --workers 4
+#
+# By default service latency is added up from MODEL_CONFIGS; with
+# --simulate-latency the fake services sleep instead, so deadline-based model
+# fallback behaves as it would live (and replays take real time).
+#
+# Transcripts are JSONL, one conversation per line:
+#   {"conversation_id": "abc", "turns": [{"user": "...", "assistant": "recorded reply (optional)"}]}
+# or read straight from the app's transcript store with --transcript-store.
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+VARIANTS = [
+    os.path.join(HERE, name)
+    for name in ["ClaudeVersion_Nohistory.py", "BranchStreamlit7-2.py", "tempmain.py", "tempmain2.py"]
+]
+
+_loaded_variants = {}
+
+def load_variant(path: str) -> Dict:
+    # Execute the variant's definitions without its module-level OpenAI client
+    # (which reads st.secrets) or its `if __name__ == "__main__"` block. Module
+    # functions look `client` / `get_openai_client` up at call time, so each
+    # replay injects its own.
+    if path in _loaded_variants:
+        return _loaded_variants[path]
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), filename=path)
+    body = []
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(
+            isinstance(target, ast.Name) and target.id == "client" for target in node.targets
+        ):
+            continue
+        if isinstance(node, ast.If) and "__name__" in ast.dump(node.test):
+            continue
+        body.append(node)
+    tree.body = body
+    namespace = {"__name__": f"replay_{os.path.splitext(os.path.basename(path))[0]}", "__file__": path}
+    exec(compile(tree, path, "exec"), namespace)
+    _loaded_variants[path] = namespace
+    return namespace
+
+class ReplaySessionState(dict):
+    # Stands in for st.session_state: item and attribute access to the same values
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        self[name] = value
+
+def accepts(function, name: str) -> bool:
+    return name in inspect.signature(function).parameters
+
+def history_bytes(variant: Dict, state: ReplaySessionState) -> int:
+    # Per-session chat history footprint at the end of a replay, as the app
+    # itself reports it where it does, otherwise the size of the messages
+    # lists without the shared prompt strings
+    outcomes = state.get("turn_outcomes")
+    if outcomes:
+        return outcomes[-1].history_bytes
+    shared = {id(variant.get("SYSTEM_MESSAGE")), id(variant.get("INITIAL_GREETING"))}
+    total = 0
+    for name in ("messages", "backend_messages"):
+        messages = state.get(name) or []
+        total += sys.getsizeof(messages)
+        for message in messages:
+            total += sys.getsizeof(message) + sum(
+                sys.getsizeof(value) for value in message.values() if id(value) not in shared
+            )
+    return total
+
+def build_index(corpus_path: str = None) -> LocalIndex:
+    index = LocalIndex()
+    if corpus_path:
+        # Corpus JSONL: {"id": ..., "text": ..., "metadata": {...}}
+        with open(corpus_path, encoding="utf-8") as f:
+            documents = [json.loads(line) for line in f if line.strip()]
+        index.upsert(vectors=[
+            (document["id"], fake_embedding(document["text"]), document.get("metadata", {}))
+            for document in documents
+        ])
+    return index
+
+def replay_conversation(variant_path: str, model_name: str, conversation: Dict, corpus_path: str = None,
+                        simulate_latency: bool = False) -> Dict:
+    variant = load_variant(variant_path)
+    model_configs = variant.get("MODEL_CONFIGS", {})
+    if model_name not in model_configs:
+        return {"variant": variant_path, "model": model_name, "error": f"{model_name} not in MODEL_CONFIGS"}
+    if "handle_turn" not in variant:
+        return {"variant": variant_path, "model": model_name, "error": "no handle_turn"}
+
+    turns = conversation["turns"]
+    manager_class = variant["APIManager"]
+    # Variants that take model_name pick their own models per call (deadline
+    # fallback, intake extraction); only the others have theirs overridden
+    takes_model_name = accepts(manager_class.__init__, "model_name")
+    client = FakeOpenAIClient(
+        model_configs=model_configs,
+        recorded_replies=[turn["assistant"] for turn in turns if turn.get("assistant")],
+        model_override=None if takes_model_name else model_name,
+        simulate_latency=simulate_latency
+    )
+    variant["client"] = client
+    # Variants that build their clients and stores lazily look them up through
+    # these getters at call time
+    variant["get_openai_client"] = lambda: client
+    variant["get_transcript_store"] = lambda: LocalTranscriptStore(":memory:")
+    index = build_index(corpus_path)
+    if takes_model_name:
+        api_manager = manager_class(index, model_name=model_name)
+    else:
+        api_manager = manager_class(index)
+
+    # Every non-empty retrieval result, including prefetched ones; a turn is a
+    # retrieval hit when its request carries a new system block holding one
+    retrieved = []
+    query_pinecone = api_manager.query_pinecone
+
+    def recording_query(*args, **kwargs):
+        result = query_pinecone(*args, **kwargs)
+        if result:
+            retrieved.append(result)
+        return result
+    api_manager.query_pinecone = recording_query
+
+    conversation_id = conversation.get("conversation_id", "replay")
+    state = ReplaySessionState(user_id="replay-user", conversation_id=conversation_id)
+    variant["initialize_session_state"](state)
+    replay_thread = threading.current_thread().name
+
+    turn_latencies_ms, retrieval_hits = [], 0
+    previous_blocks = set()
+    for turn in turns:
+        calls_before = len(client.calls)
+        started = time.perf_counter()
+        shown = {}
+
+        def render(reply):
+            # The reply counts as shown once rendering finishes; for a stream
+            # the service time is taken to its first token
+            text = reply if isinstance(reply, str) else "".join(reply)
+            shown["ms"] = (time.perf_counter() - started) * 1000
+            shown["calls"] = len(client.calls)
+            return text
+
+        variant["handle_turn"](api_manager, state, turn["user"], render)
+
+        # Background calls (intake extraction, prefetch) and anything after the
+        # render (persistence) are off the user-visible path
+        foreground = [
+            call for call in client.calls[calls_before:shown["calls"]] if call["thread"] == replay_thread
+        ]
+        if simulate_latency:
+            turn_latencies_ms.append(shown["ms"] - sum(
+                call["simulated_ms"] - call["first_token_ms"] for call in foreground if call.get("stream")
+            ))
+        else:
+            turn_latencies_ms.append(shown["ms"] + sum(
+                call["first_token_ms"] if call.get("stream") else call["simulated_ms"] for call in foreground
+            ))
+        request = next((call for call in reversed(foreground) if call["kind"] == "chat"), None)
+        if request is None:
+            continue
+        blocks = {message["content"] for message in request["messages"] if message["role"] == "system"}
+        if any(result in block for block in blocks - previous_blocks for result in retrieved):
+            retrieval_hits += 1
+        previous_blocks = blocks
+
+    # Let background extraction and prefetch finish, so their calls are costed
+    # here rather than logged into the next replay's client
+    for value in list(state.values()):
+        if hasattr(value, "drain"):
+            value.drain()
+
+    cost = 0.0
+    for call in client.calls:
+        config = model_configs.get(call["model"])
+        if config is not None:
+            cost += (call["prompt_tokens"] + call["completion_tokens"]) / 1000 * config.cost_per_1k_tokens
+    chat_calls = [call for call in client.calls if call["kind"] == "chat"]
+    return {
+        "variant": variant_path,
+        "model": model_name,
+        "conversation_id": conversation_id,
+        "turns": len(turns),
+        "turn_latencies_ms": turn_latencies_ms,
+        "prompt_tokens": sum(call["prompt_tokens"] for call in chat_calls),
+        "completion_tokens": sum(call["completion_tokens"] for call in chat_calls),
+        "embedding_tokens": sum(call["prompt_tokens"] for call in client.calls if call["kind"] == "embedding"),
+        "cost": cost,
+        "retrieval_hits": retrieval_hits,
+        "history_bytes": history_bytes(variant, state),
+    }
+
+def _replay_job(job):
+    return replay_conversation(*job)
+
+def load_transcripts(path: str = None, transcript_store_path: str = None) -> List[Dict]:
+    conversations = []
+    if path:
+        with open(path, encoding="utf-8") as f:
+            conversations.extend(json.loads(line) for line in f if line.strip())
+    if transcript_store_path:
+        from transcript_store import LocalTranscriptStore
+        store = LocalTranscriptStore(transcript_store_path)
+        for conversation_id in store.conversations():
+            turns = []
+            for message in store.load(conversation_id):
+                if message["role"] == "user":
+                    turns.append({"user": message["content"]})
+                elif message["role"] == "assistant" and turns and "assistant" not in turns[-1]:
+                    turns[-1]["assistant"] = message["content"]
+            conversations.append({"conversation_id": conversation_id, "turns": turns})
+    return conversations
+
+def summarize(results: List[Dict]) -> List[Dict]:
+    rows = []
+    key = lambda result: (result["variant"], result["model"])
+    for (variant, model), group in itertools.groupby(sorted(results, key=key), key=key):
+        group = list(group)
+        errors = [result["error"] for result in group if "error" in result]
+        if errors:
+            rows.append({"variant": os.path.basename(variant), "model": model, "error": errors[0]})
+            continue
+        latencies = sorted(itertools.chain.from_iterable(result["turn_latencies_ms"] for result in group))
+        turns = sum(result["turns"] for result in group)
+        rows.append({
+            "variant": os.path.basename(variant),
+            "model": model,
+            "conversations": len(group),
+            "turns": turns,
+            "p50_ms": statistics.median(latencies) if latencies else 0.0,
+            "p95_ms": latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))] if latencies else 0.0,
+            "tokens_per_turn": sum(r["prompt_tokens"] + r["completion_tokens"] for r in group) / max(1, turns),
+            "cost_per_turn": sum(r["cost"] for r in group) / max(1, turns),
+            "retrieval_hit_rate": sum(r["retrieval_hits"] for r in group) / max(1, turns),
+            "history_kb": max(r["history_bytes"] for r in group) / 1024,
+        })
+    return rows
+
+def print_table(rows: List[Dict]):
+    header = f"{'variant':<28} {'model':<12} {'turns':>6} {'p50 ms':>9} {'p95 ms':>9} {'tok/turn':>9} {'$/turn':>9} {'hits':>6} {'hist KB':>8}"
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        if "error" in row:
+            print(f"{row['variant']:<28} {row['model']:<12} {row['error']}")
+            continue
+        print(
+            f"{row['variant']:<28} {row['model']:<12} {row['turns']:>6} {row['p50_ms']:>9.0f} "
+            f"{row['p95_ms']:>9.0f} {row['tokens_per_turn']:>9.0f} {row['cost_per_turn']:>9.4f} "
+            f"{row['retrieval_hit_rate']:>6.0%} {row['history_kb']:>8.1f}"
+        )
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay transcripts through app variants and compare them.")
+    parser.add_argument("transcripts", nargs="?", help="Transcript JSONL file")
+    parser.add_argument("--transcript-store", help="Also replay every conversation in this SQLite transcript store")
+    parser.add_argument("--variants", nargs="+", default=VARIANTS)
+    parser.add_argument("--models", nargs="+", default=["gpt-4o"], help="MODEL_CONFIGS entries to compare")
+    parser.add_argument("--corpus", help="Corpus JSONL loaded into the local index for retrieval")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--simulate-latency", action="store_true",
+                        help="Sleep for simulated service latency so deadline fallback behaves as live")
+    parser.add_argument("--output", help="Write per-conversation results and the summary as JSON")
+    args = parser.parse_args()
+
+    conversations = load_transcripts(args.transcripts, args.transcript_store)
+    if not conversations:
+        parser.error("no transcripts to replay")
+    # Variants import sibling modules (turn_budget, metadata_store, ...)
+    sys.path.insert(0, HERE)
+
+    jobs = [
+        (variant, model, conversation, args.corpus, args.simulate_latency)
+        for variant in args.variants
+        for model in args.models
+        for conversation in conversations
+    ]
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        results = list(pool.map(_replay_job, jobs))
+
+    rows = summarize(results)
+    print_table(rows)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"summary": rows, "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import re
+from typing import Dict, List, Set
+
+from token_utils import count_tokens, truncate_to_tokens
+
+# Snippets shorter than this are not worth including once the budget is tight
+MIN_SNIPPET_TOKENS = 24
+# Leading characters compared when checking whether a snippet was already seen;
+# earlier context blocks may only hold a truncated copy
+SEEN_PROBE_CHARS = 200
+# Word n-gram length used to compare snippets for MMR redundancy
+SHINGLE_WORDS = 3
+
+def normalize_text(text: str) -> str:
+    return re.sub(r"\s+", " ", text or "").strip().lower()
+
+def drop_seen_matches(matches: List, seen_texts: List[str]) -> List:
+    # Conversation turns come back from the index verbatim; skip any whose
+    # snippet is already part of the history or an earlier context block
+    seen = [normalize_text(text) for text in seen_texts if text]
+    kept = []
+    for match in matches:
+        probe = normalize_text(match.get("metadata", {}).get("snippet", ""))[:SEEN_PROBE_CHARS]
+        if probe and any(probe in text for text in seen):
+            continue
+        kept.append(match)
+    return kept
+
+def collapse_to_parent(matches: List) -> List:
+    # Long turns are stored as several chunk vectors sharing a parent_id; keep
+    # only the best-ranked chunk per parent so one turn cannot fill the results
+    seen_parents = set()
+    collapsed = []
+    for match in matches:
+        parent_id = match.get("metadata", {}).get("parent_id") or match.get("id")
+        if parent_id in seen_parents:
+            continue
+        seen_parents.add(parent_id)
+        collapsed.append(match)
+    return collapsed
+
+def shingles(text: str, size: int = SHINGLE_WORDS) -> Set[str]:
+    words = normalize_text(text).split()
+    if len(words) <= size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[start:start + size]) for start in range(len(words) - size + 1)}
+
+def jaccard_similarity(a: Set[str], b: Set[str]) -> float:
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+def mmr_select(matches: List, k: int, lambda_mult: float = 0.7) -> List:
+    # Maximal marginal relevance: trade the index score against overlap with
+    # matches already picked. Overlap is measured on snippet text, so queries
+    # never have to ship the candidates' vector values.
+    relevance = [match.get("score") or 0.0 for match in matches]
+    texts = [shingles(match.get("metadata", {}).get("snippet", "")) for match in matches]
+
+    selected = []
+    remaining = list(range(len(matches)))
+    while remaining and len(selected) < k:
+        def marginal_relevance(position: int) -> float:
+            redundancy = max(
+                (jaccard_similarity(texts[position], texts[chosen]) for chosen in selected),
+                default=0.0
+            )
+            return lambda_mult * relevance[position] - (1 - lambda_mult) * redundancy
+
+        best = max(remaining, key=marginal_relevance)
+        selected.append(best)
+        remaining.remove(best)
+    return [matches[position] for position in selected]
+
+def truncate_snippets(matches: List, max_snippet_tokens: int) -> List[Dict]:
+    # Returns metadata dicts with long snippets cut down; the matches themselves
+    # are left untouched
+    compacted = []
+    for match in matches:
+        metadata = dict(match.get("metadata", {}))
+        if "snippet" in metadata:
+            metadata["snippet"] = truncate_to_tokens(metadata["snippet"], max_snippet_tokens)
+        compacted.append(metadata)
+    return compacted
+
+def pack_blocks(blocks: List[str], token_budget: int) -> List[str]:
+    # Greedily keep blocks in rank order; the first block that does not fit is
+    # truncated into whatever budget is left
+    packed = []
+    remaining = token_budget
+    for block in blocks:
+        tokens = count_tokens(block)
+        if tokens <= remaining:
+            packed.append(block)
+            remaining -= tokens
+            continue
+        if remaining >= MIN_SNIPPET_TOKENS:
+            packed.append(truncate_to_tokens(block, remaining))
+        break
+    return packed
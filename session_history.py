@@ -0,0 +1,111 @@
+import sys
+import zlib
+from typing import Dict, List
+
+# Turn text at least this long is kept zlib-compressed in memory
+COMPRESS_THRESHOLD_BYTES = 256
+
+class Turn:
+    __slots__ = ("role", "_data", "_compressed")
+
+    def __init__(self, role: str, text: str):
+        self.role = sys.intern(role)
+        data = text.encode("utf-8")
+        self._compressed = False
+        if len(data) >= COMPRESS_THRESHOLD_BYTES:
+            packed = zlib.compress(data)
+            if len(packed) < len(data):
+                data, self._compressed = packed, True
+        self._data = data
+
+    @property
+    def text(self) -> str:
+        data = zlib.decompress(self._data) if self._compressed else self._data
+        return data.decode("utf-8")
+
+    def as_message(self) -> Dict:
+        return {"role": self.role, "content": self.text}
+
+    def nbytes(self) -> int:
+        return sys.getsizeof(self) + sys.getsizeof(self._data)
+
+class SessionHistory:
+    # Compact replacement for the per-session `messages` / `backend_messages`
+    # lists. The system prompt and greeting are shared module constants held by
+    # reference; turns are slotted records with compressed text. Once a
+    # transcript store is attached, turns are written through to it and only
+    # the most recent `hot_turns` stay in memory. Evicted turns are read back
+    # from the store when a request is built, so the model still sees them.
+    def __init__(self, conversation_id: str, system_message: str, greeting: str,
+                 transcript_store=None, hot_turns: int = 40, max_context_blocks: int = 6):
+        self.conversation_id = conversation_id
+        self.system_message = system_message
+        self.greeting = greeting
+        self.transcript_store = transcript_store
+        self.hot_turns = hot_turns
+        self.max_context_blocks = max_context_blocks
+        self.turns: List[Turn] = []
+        self.context_blocks: List[Turn] = []
+        # Positions are counted over the whole conversation, including evicted turns
+        self.evicted_count = 0
+        self.persisted_count = 0
+
+    def add(self, role: str, text: str) -> int:
+        # Returns the turn's position in the whole conversation
+        self.turns.append(Turn(role, text))
+        return self.total_turns() - 1
+
+    def total_turns(self) -> int:
+        return self.evicted_count + len(self.turns)
+
+    def add_context(self, text: str):
+        # Older retrieval results go stale; keep only the most recent blocks
+        self.context_blocks.append(Turn("system", text))
+        del self.context_blocks[:-self.max_context_blocks]
+
+    def cold_messages(self) -> List[Dict]:
+        if not self.evicted_count:
+            return []
+        stored = self.transcript_store.load(self.conversation_id, end_position=self.evicted_count)
+        return [{"role": message["role"], "content": message["content"]} for message in stored]
+
+    def build_request(self) -> List[Dict]:
+        # Same layout as before: system prompt, backend context, then the whole
+        # chat, with turns no longer held in memory loaded for this request only
+        return (
+            [{"role": "system", "content": self.system_message}]
+            + [block.as_message() for block in self.context_blocks]
+            + [{"role": "assistant", "content": self.greeting}]
+            + self.cold_messages()
+            + [turn.as_message() for turn in self.turns]
+        )
+
+    def seen_texts(self) -> List[str]:
+        return [turn.text for turn in self.turns] + [block.text for block in self.context_blocks]
+
+    def persist_pending(self):
+        if self.transcript_store is None:
+            return
+        total = self.total_turns()
+        pending = self.turns[self.persisted_count - self.evicted_count:]
+        if pending:
+            self.transcript_store.append(
+                self.conversation_id, self.persisted_count, [turn.as_message() for turn in pending]
+            )
+            self.persisted_count = total
+        self._evict()
+
+    def _evict(self):
+        # Only turns already in the transcript store may leave memory
+        overflow = min(len(self.turns) - self.hot_turns, self.persisted_count - self.evicted_count)
+        if overflow > 0:
+            del self.turns[:overflow]
+            self.evicted_count += overflow
+
+    def nbytes(self) -> int:
+        # Per-session footprint; the shared prompt strings are not counted
+        return (
+            sys.getsizeof(self)
+            + sys.getsizeof(self.turns) + sum(turn.nbytes() for turn in self.turns)
+            + sys.getsizeof(self.context_blocks) + sum(block.nbytes() for block in self.context_blocks)
+        )
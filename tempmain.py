@@ -1,15 +1,9 @@
-import os
 import streamlit as st
-from openai import OpenAI
 from typing import Dict, List
 from dataclasses import dataclass
 from enum import Enum
-import json
-import pinecone
 import uuid
-
-# Ensure OpenAI and Pinecone API keys are set via st.secrets or environment variables
-client = OpenAI(api_key=st.secrets["openai"]["api_key"])
+from warmup import Warmup
 
 # ---- Constants and Configuration ----
 class ModelTier(Enum):
@@ -110,7 +104,7 @@ class APIManager:
         self.model_config = MODEL_CONFIGS[model_name]  # Select model dynamically
 
     def embed_text(self, text: str) -> List[float]:
-        response = client.embeddings.create(
+        response = get_openai_client().embeddings.create(
             model="text-embedding-3-large",
             input=text
         )
@@ -159,7 +153,7 @@ class APIManager:
 
     def generate_response(self, messages: List[Dict]) -> str:
         try:
-            response = client.chat.completions.create(
+            response = get_openai_client().chat.completions.create(
                 model=self.model_config.name,  # Use dynamic model selection
                 messages=messages,
                 temperature=self.model_config.quality_score  # Use quality_score as a proxy for temperature
@@ -169,7 +163,8 @@ class APIManager:
             print(f"Error in generate_response: {str(e)}")
             return "I apologize, but I encountered an error processing your request."
 
-    def store_conversation_turn(self, user_id: str, conversation_id: str, role: str, content: str):
+    def store_conversation_turn(self, user_id: str, conversation_id: str, role: str, content: str,
+                                position: int):
         # Embed and store a single conversation turn as a vector
         embeddings = self.embed_text(content)
         doc_id = f"conversation_{conversation_id}_{role}_{uuid.uuid4().hex[:6]}"
@@ -178,34 +173,114 @@ class APIManager:
             "conversation_id": conversation_id,
             "role": role,
             "snippet": content,
-            "type": "conversation"
+            "type": "conversation",
+            "position": position  # Order of the turn in the conversation, greeting excluded
         }
         self.pinecone_index.upsert(vectors=[(doc_id, embeddings, metadata)])
 
 
-def initialize_session_state():
-    if 'initialized' not in st.session_state:
-        st.session_state.initialized = True
+def build_openai_client():
+    # Ensure OpenAI and Pinecone API keys are set via st.secrets or environment variables
+    from openai import OpenAI
+    return OpenAI(api_key=st.secrets["openai"]["api_key"])
+
+def build_pinecone_index():
+    import pinecone
+    pinecone.init(
+        api_key=st.secrets["pinecone"]["api_key"],
+        environment=st.secrets["pinecone"]["environment"]
+    )
+    return pinecone.Index("mediation4")
+
+@st.cache_resource
+def get_warm_resources():
+    # Started once per server process by the first session; the client and
+    # index handle are built in the background while the page renders
+    return Warmup(
+        builders={
+            "openai": build_openai_client,
+            "pinecone_index": build_pinecone_index,
+        },
+        warmers={
+            # Cheap requests that open the HTTPS connections ahead of the first turn
+            "openai": lambda client: client.models.retrieve("gpt-4o"),
+            "pinecone_index": lambda index: index.describe_index_stats(),
+        }
+    )
+
+def get_openai_client():
+    return get_warm_resources().get("openai")
+
+def get_pinecone_index():
+    return get_warm_resources().get("pinecone_index")
+
+# replay_eval.py passes its own state object
+def initialize_session_state(state=None):
+    state = st.session_state if state is None else state
+    if 'initialized' not in state:
+        state.initialized = True
 
         # Prompt user for user_id
-        if "user_id" not in st.session_state:
-            st.session_state.user_id = st.text_input("Please enter your user ID:", key="init_user_id")
+        if "user_id" not in state:
+            state.user_id = st.text_input("Please enter your user ID:", key="init_user_id")
             st.stop()
 
-        if st.session_state.user_id:
+        if state.user_id:
             # Generate a unique conversation_id for this session
-            if "conversation_id" not in st.session_state:
-                st.session_state.conversation_id = uuid.uuid4().hex[:8]
+            if "conversation_id" not in state:
+                state.conversation_id = uuid.uuid4().hex[:8]
 
-            st.session_state.messages = [
+            state.messages = [
                 {"role": "system", "content": SYSTEM_MESSAGE},
                 {"role": "assistant", "content": INITIAL_GREETING}
             ]
-            st.session_state.current_response = INITIAL_GREETING
-            st.session_state.backend_messages = []
+            state.current_response = INITIAL_GREETING
+            state.backend_messages = []
+
+def handle_turn(api_manager, state, user_input: str, render) -> str:
+    # One user turn against the session state; replay_eval.py runs this same function
+    # Store user message in conversation memory; messages[0:2] are the system
+    # prompt and greeting
+    api_manager.store_conversation_turn(
+        state.user_id, state.conversation_id, "user", user_input, len(state.messages) - 2
+    )
+
+    # Add user message to conversation history
+    state.messages.append({"role": "user", "content": user_input})
+
+    # Query Pinecone for relevant info (including past conversation turns and documents)
+    relevant_info = api_manager.query_pinecone(user_input)
+    if relevant_info:
+        state.backend_messages.append({
+            "role": "system",
+            "content": f"Relevant context:\n{relevant_info}"
+        })
+
+    # Combine messages for API call
+    full_context = (
+        [state.messages[0]]  # system message
+        + state.backend_messages
+        + state.messages[1:]
+    )
+
+    # Generate response
+    response = api_manager.generate_response(full_context)
+    state.current_response = response
+    state.messages.append({"role": "assistant", "content": response})
+
+    # Store assistant message in conversation memory
+    api_manager.store_conversation_turn(
+        state.user_id, state.conversation_id, "assistant", response, len(state.messages) - 3
+    )
+
+    # Render the reply in place; no second script run needed
+    render(response)
+    return response
 
 
 def main():
+    # Start building the client and index handle before anything renders
+    get_warm_resources()
     st.title("Collins Family Mediation AI Intermediary")
 
     # Initialize session state and wait for user_id
@@ -213,57 +288,19 @@ def main():
     if not st.session_state.get("user_id"):
         return
 
-    user_id = st.session_state.user_id
-    conversation_id = st.session_state.conversation_id
-
-    # Initialize Pinecone
-    pinecone.init(
-        api_key=st.secrets["pinecone"]["api_key"],
-        environment=st.secrets["pinecone"]["environment"]
-    )
-    index = pinecone.Index("mediation4")
-
     # Select the model dynamically
     selected_model_name = "gpt-4o"  # Change to "gpt-4o-mini" if needed
-    api_manager = APIManager(index, model_name=selected_model_name)
 
     # Display the AI response
-    st.write(st.session_state.current_response)
+    response_placeholder = st.empty()
+    response_placeholder.write(st.session_state.current_response)
 
     user_input = st.chat_input("Your response:")
 
     if user_input:
-        # Store user message in conversation memory
-        api_manager.store_conversation_turn(user_id, conversation_id, "user", user_input)
-
-        # Add user message to conversation history
-        st.session_state.messages.append({"role": "user", "content": user_input})
-
-        # Query Pinecone for relevant info (including past conversation turns and documents)
-        relevant_info = api_manager.query_pinecone(user_input)
-        if relevant_info:
-            st.session_state.backend_messages.append({
-                "role": "system",
-                "content": f"Relevant context:\n{relevant_info}"
-            })
-
-        # Combine messages for API call
-        full_context = (
-            [st.session_state.messages[0]]  # system message
-            + st.session_state.backend_messages
-            + st.session_state.messages[1:]
-        )
-
-        # Generate response
-        response = api_manager.generate_response(full_context)
-        st.session_state.current_response = response
-        st.session_state.messages.append({"role": "assistant", "content": response})
-
-        # Store assistant message in conversation memory
-        api_manager.store_conversation_turn(user_id, conversation_id, "assistant", response)
-
-        # Refresh display
-        st.experimental_rerun()
+        # Only a turn waits for the warmup
+        api_manager = APIManager(get_pinecone_index(), model_name=selected_model_name)
+        handle_turn(api_manager, st.session_state, user_input, response_placeholder.write)
 
 if __name__ == "__main__":
     main()
@@ -1,15 +1,22 @@
-import os
 import streamlit as st
-from openai import OpenAI
 from typing import Dict, List
 from dataclasses import dataclass
 from enum import Enum
-import json
-import pinecone
 import uuid
-
-# Ensure OpenAI and Pinecone API keys are set via st.secrets or environment variables
-client = OpenAI(api_key=st.secrets["openai"]["api_key"])
+import time
+from collections import deque
+from turn_budget import TurnExecutor, Deadline, StageOutcome
+from retrieval_compression import (
+    collapse_to_parent, drop_seen_matches, mmr_select, truncate_snippets, pack_blocks
+)
+from metadata_store import (
+    LocalMetadataStore, MongoMetadataStore, CachedMetadataStore, split_metadata, hydrate_matches
+)
+from session_history import SessionHistory
+from transcript_store import LocalTranscriptStore, MongoTranscriptStore
+from token_utils import get_encoding, split_into_chunks
+from warmup import Warmup
+from phase_prefetch import IntakePhase, PhasePrefetcher, detect_phase, next_phase
 
 # ---- Constants and Configuration ----
 class ModelTier(Enum):
@@ -32,6 +39,46 @@ MODEL_CONFIGS = {
     "text-embedding-3-large": ModelConfig("text-embedding-3-large", 100, 0.0004, 3072, 100, 0.90)
 }
 
+# Per-turn latency target from user input to the first streamed token of the
+# reply. Retrieval is dropped and the response model downgraded when the budget
+# cannot cover them.
+TURN_SLO_SECONDS = 2.5
+# Hard cap on a single chat completion so one slow call cannot stall a turn
+GENERATION_TIMEOUT_SECONDS = 20
+
+# Retrieval fetches a wider candidate pool, drops matches already in the
+# history, diversifies with MMR and packs what is left into a token budget.
+# Vector values are never requested; MMR compares snippet text instead.
+RETRIEVAL_CANDIDATES = 8
+RETRIEVAL_TOP_K = 3
+MAX_SNIPPET_TOKENS = 200
+CONTEXT_TOKEN_BUDGET = 500
+
+# Stored turns longer than this are split into chunk vectors that share a
+# parent_id; sized to fit a snippet so retrieved chunks are never truncated
+TURN_CHUNK_TOKENS = 200
+
+# When enabled, the vector index only holds ids and filterable fields; full
+# text and metadata live in a side store (Mongo if configured in st.secrets,
+# otherwise a local SQLite file) and query results are hydrated from it
+ID_ONLY_VECTORS = False
+METADATA_STORE_PATH = "metadata_store.db"
+# Budget needed for the index fetch that backfills ids missing from the side
+# store; without it those matches are dropped for the turn
+HYDRATE_FETCH_ESTIMATE_MS = 150
+
+# Session history keeps this many recent turns in memory; older turns live in
+# the transcript store (Mongo if configured in st.secrets, otherwise SQLite)
+HOT_TURNS = 40
+MAX_CONTEXT_BLOCKS = 6
+TRANSCRIPT_STORE_PATH = "transcripts.db"
+# Per-session turn outcomes kept for latency reporting
+MAX_TURN_OUTCOMES = 200
+
+# Corpus retrieval for the upcoming intake phases runs while the user types;
+# results are reused on the turn that enters the phase
+PREFETCH_TTL_SECONDS = 300
+
 INITIAL_GREETING = """Hello! I'm the Collins Family Mediation Intermediary. I'm here to gather information and clarify issues to help you get a head start on your mediation sessions with the Collinses. To get started, could you please tell me your first name?"""
 
 SYSTEM_MESSAGE = """
@@ -126,31 +173,57 @@ End with a supportive, empathetic note, highlighting that these insights will he
 """
 
 class APIManager:
-    def __init__(self, pinecone_index, model_name: str):
+    def __init__(self, pinecone_index, model_name: str, metadata_store=None):
         self.pinecone_index = pinecone_index
         self.model_config = MODEL_CONFIGS[model_name]  # Select model dynamically
+        self.metadata_store = metadata_store
 
-    def embed_text(self, text: str) -> List[float]:
+    def embed_text(self, text: str, deadline: Deadline = None) -> List[float]:
+        client = get_openai_client()
+        if deadline is not None:
+            # The client's default retries would each get the full timeout
+            client = client.with_options(max_retries=0, timeout=deadline.remaining_seconds())
         response = client.embeddings.create(
             model="text-embedding-3-large",
             input=text
         )
         return response.data[0].embedding
 
-    def query_pinecone(self, user_input: str) -> str:
+    def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        # One request for all chunks of a turn
+        response = get_openai_client().embeddings.create(
+            model="text-embedding-3-large",
+            input=texts
+        )
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+    def query_pinecone(self, user_input: str, deadline: Deadline = None, seen_texts: List[str] = None) -> str:
         try:
-            embedding = self.embed_text(user_input)
+            embedding = self.embed_text(user_input, deadline=deadline)
+            if deadline is not None and deadline.expired():
+                # Embedding used up the budget; answer without retrieved context
+                return ""
 
             # Query Pinecone
             results = self.pinecone_index.query(
                 vector=embedding,
-                top_k=3,
-                include_metadata=True
+                top_k=RETRIEVAL_CANDIDATES,
+                include_metadata=self.metadata_store is None
             )
 
+            matches = results["matches"]
+            if self.metadata_store is not None:
+                fetch_missing = deadline is None or deadline.can_afford(HYDRATE_FETCH_ESTIMATE_MS)
+                matches = hydrate_matches(
+                    matches, self.metadata_store, self.pinecone_index, fetch_missing=fetch_missing
+                )
+                matches = [match for match in matches if match["metadata"]]
+            matches = collapse_to_parent(matches)
+            matches = drop_seen_matches(matches, seen_texts or [])
+            matches = mmr_select(matches, k=RETRIEVAL_TOP_K)
+
             relevant_info = []
-            for match in results["matches"]:
-                metadata = match.get('metadata', {})
+            for metadata in truncate_snippets(matches, MAX_SNIPPET_TOKENS):
                 info_parts = []
                 # Include fields from both documents and conversation turns
                 if "title" in metadata:
@@ -173,78 +246,237 @@ class APIManager:
                 if info_parts:
                     relevant_info.append("\n".join(info_parts))
 
+            relevant_info = pack_blocks(relevant_info, CONTEXT_TOKEN_BUDGET)
             return "\n\n".join(relevant_info) if relevant_info else ""
         except Exception as e:
             print(f"Error in query_pinecone: {str(e)}")
             return ""
 
-    def generate_response(self, messages: List[Dict]) -> str:
+    def stream_response(self, messages: List[Dict], model_name: str = None):
+        # Yields the reply as it is generated so it renders from the first token
+        model_config = MODEL_CONFIGS[model_name] if model_name else self.model_config
         try:
-            response = client.chat.completions.create(
-                model=self.model_config.name,  # Use dynamic model selection
+            stream = get_openai_client().chat.completions.create(
+                model=model_config.name,
                 messages=messages,
-                temperature=self.model_config.quality_score  # Use quality_score as a proxy for temperature
+                temperature=model_config.quality_score,
+                timeout=GENERATION_TIMEOUT_SECONDS,
+                stream=True
             )
-            return response.choices[0].message.content
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
         except Exception as e:
-            print(f"Error in generate_response: {str(e)}")
-            return "I apologize, but I encountered an error processing your request."
-
-    def store_conversation_turn(self, conversation_id: str, role: str, content: str):
-        # Embed and store a single conversation turn as a vector
-        embeddings = self.embed_text(content)
-        doc_id = f"conversation_{conversation_id}_{role}_{uuid.uuid4().hex[:6]}"
-        metadata = {
-            "conversation_id": conversation_id,
-            "role": role,
-            "snippet": content,
-            "type": "conversation"
+            print(f"Error in stream_response: {str(e)}")
+            yield "I apologize, but I encountered an error processing your request."
+
+    def store_conversation_turn(self, conversation_id: str, role: str, content: str, position: int):
+        # Embed and store a conversation turn; long turns become one vector per
+        # chunk, all embedded in a single request and tied together by parent_id
+        turn_id = f"conversation_{conversation_id}_{role}_{uuid.uuid4().hex[:6]}"
+        chunks = split_into_chunks(content, TURN_CHUNK_TOKENS)
+        embeddings = self.embed_texts(chunks)
+        created_at = int(time.time())  # Used by compact_conversations.py to find closed conversations
+
+        vectors, side_records = [], {}
+        for chunk_index, (chunk, values) in enumerate(zip(chunks, embeddings)):
+            metadata = {
+                "conversation_id": conversation_id,
+                "role": role,
+                "snippet": chunk,
+                "type": "conversation",
+                "created_at": created_at,
+                # Order of the turn in the conversation; user and assistant
+                # turns usually share a created_at second
+                "position": position
+            }
+            doc_id = turn_id
+            if len(chunks) > 1:
+                doc_id = f"{turn_id}_c{chunk_index}"
+                metadata["parent_id"] = turn_id
+                metadata["chunk_index"] = chunk_index
+            if self.metadata_store is not None:
+                metadata, side_records[doc_id] = split_metadata(metadata)
+            vectors.append((doc_id, values, metadata))
+
+        if side_records:
+            self.metadata_store.put_many(side_records)
+        self.pinecone_index.upsert(vectors=vectors)
+
+# Heavy client libraries are imported on first use rather than at script start
+def build_openai_client():
+    # Ensure OpenAI and Pinecone API keys are set via st.secrets or environment variables
+    from openai import OpenAI
+    return OpenAI(api_key=st.secrets["openai"]["api_key"])
+
+def build_pinecone_index():
+    from pinecone import Pinecone
+    pc = Pinecone(api_key=st.secrets["pinecone"]["api_key"])
+    return pc.Index("mediation4")
+
+@st.cache_resource
+def get_warm_resources():
+    # Started once per server process by the first session; the clients, index
+    # handle and tokenizer are built in the background while the page renders
+    return Warmup(
+        builders={
+            "openai": build_openai_client,
+            "pinecone_index": build_pinecone_index,
+            "tokenizer": get_encoding,
+        },
+        warmers={
+            # Cheap requests that open the HTTPS connections ahead of the first turn
+            "openai": lambda client: client.models.retrieve("gpt-4o"),
+            "pinecone_index": lambda index: index.describe_index_stats(),
         }
-        self.pinecone_index.upsert(vectors=[(doc_id, embeddings, metadata)])
-
-# Initialize session state
-def initialize_session_state():
-    if 'initialized' not in st.session_state:
-        st.session_state.initialized = True
+    )
+
+def get_openai_client():
+    return get_warm_resources().get("openai")
+
+def get_pinecone_index():
+    return get_warm_resources().get("pinecone_index")
+
+@st.cache_resource
+def get_metadata_store():
+    if not ID_ONLY_VECTORS:
+        return None
+    if "mongo" in st.secrets:
+        store = MongoMetadataStore(st.secrets["mongo"]["uri"])
+    else:
+        store = LocalMetadataStore(METADATA_STORE_PATH)
+    return CachedMetadataStore(store)
+
+@st.cache_resource
+def get_transcript_store():
+    if "mongo" in st.secrets:
+        return MongoTranscriptStore(st.secrets["mongo"]["uri"])
+    return LocalTranscriptStore(TRANSCRIPT_STORE_PATH)
+
+def prefetch_intake_phases(api_manager, state, phase: IntakePhase):
+    # Retrieval for the phase being asked about and the one after it
+    seen_texts = state.history.seen_texts()
+    retrieve = lambda query: api_manager.query_pinecone(query, seen_texts=seen_texts)
+    for upcoming in (phase, next_phase(phase)):
+        if upcoming is not None:
+            state.prefetcher.prefetch(upcoming, retrieve)
+
+# Initialize session state; replay_eval.py passes its own state object
+def initialize_session_state(state=None):
+    state = st.session_state if state is None else state
+    if 'initialized' not in state:
+        state.initialized = True
 
         # Ensure current_response is initialized
-        if "current_response" not in st.session_state:
-            st.session_state.current_response = INITIAL_GREETING
+        if "current_response" not in state:
+            state.current_response = INITIAL_GREETING
 
         # Ensure conversation_id is initialized
-        if "conversation_id" not in st.session_state:
-            st.session_state.conversation_id = str(uuid.uuid4().hex[:8])
-
-        # Ensure backend_messages is initialized
-        if "backend_messages" not in st.session_state:
-            st.session_state.backend_messages = []
+        if "conversation_id" not in state:
+            state.conversation_id = str(uuid.uuid4().hex[:8])
+
+        # Latency estimates are learned per session from completed turns
+        if "turn_executor" not in state:
+            state.turn_executor = TurnExecutor(MODEL_CONFIGS, slo_seconds=TURN_SLO_SECONDS)
+        if "turn_outcomes" not in state:
+            state.turn_outcomes = deque(maxlen=MAX_TURN_OUTCOMES)
+
+        # The greeting asks for a first name, so the intake starts in NAMES
+        if "intake_phase" not in state:
+            state.intake_phase = IntakePhase.NAMES
+            state.answered_phase = None
+            state.prefetcher = PhasePrefetcher(ttl_seconds=PREFETCH_TTL_SECONDS)
+
+        # Conversation history and retrieved context; the shared prompts are
+        # referenced, not copied, and cold turns spill to the transcript store
+        if "history" not in state:
+            state.history = SessionHistory(
+                state.conversation_id,
+                SYSTEM_MESSAGE,
+                INITIAL_GREETING,
+                transcript_store=get_transcript_store(),
+                hot_turns=HOT_TURNS,
+                max_context_blocks=MAX_CONTEXT_BLOCKS
+            )
 
-        # Initialize messages
-        if "messages" not in st.session_state:
-            st.session_state.messages = [
-                {"role": "system", "content": SYSTEM_MESSAGE},
-                {"role": "assistant", "content": INITIAL_GREETING}
-            ]
+def handle_turn(api_manager, state, user_input: str, render) -> str:
+    # One user turn against the session state. render receives the streamed
+    # reply and returns its full text; replay_eval.py runs this same function.
+    executor = state.turn_executor
+    deadline, outcome = executor.start_turn()
+
+    # Add user message to conversation history
+    history = state.history
+    user_position = history.add("user", user_input)
+
+    # A turn that answers the first question of a new phase uses the context
+    # prefetched for it, if ready, instead of an embed + query round trip
+    phase = state.intake_phase
+    relevant_info = None
+    if phase != state.answered_phase:
+        relevant_info = state.prefetcher.take(phase)
+        if relevant_info is not None:
+            outcome.stages.append(StageOutcome("retrieval", "prefetched"))
+
+    # Query Pinecone for relevant info (including past conversation turns and documents),
+    # skipping anything the model will already see in this request
+    if relevant_info is None:
+        seen_texts = history.seen_texts()
+        relevant_info = executor.run_optional(
+            deadline, outcome, "retrieval",
+            lambda: api_manager.query_pinecone(user_input, deadline=deadline, seen_texts=seen_texts),
+            default=""
+        )
+    if relevant_info:
+        history.add_context(f"Relevant context:\n{relevant_info}")
+
+    # Combine messages for API call; turns evicted from memory are read back
+    # from the transcript store, so this is timed like any other stage
+    full_context = executor.run_required(outcome, "history", history.build_request)
+
+    # Stream the response in place, switching to a faster model if the
+    # budget is short; the turn is timed to the first token on screen
+    model_name = executor.choose_model(deadline, api_manager.model_config.name)
+    response = render(executor.track_stream(
+        deadline, outcome, f"generate:{model_name}",
+        api_manager.stream_response(full_context, model_name=model_name)
+    ))
+    state.current_response = response
+    assistant_position = history.add("assistant", response)
+    executor.finish_turn(deadline, outcome, model_name)
+
+    # Work out which phase the new question belongs to and start fetching
+    # its context while the user types the answer
+    state.answered_phase = phase
+    state.intake_phase = detect_phase(response, previous=phase)
+    prefetch_intake_phases(api_manager, state, state.intake_phase)
+
+    # Store both messages in conversation memory once the reply is visible,
+    # so persistence never counts against the turn budget
+    executor.run_required(
+        outcome, "persist",
+        api_manager.store_conversation_turn, state.conversation_id, "user", user_input, user_position
+    )
+    executor.run_required(
+        outcome, "persist",
+        api_manager.store_conversation_turn, state.conversation_id, "assistant", response, assistant_position
+    )
+    history.persist_pending()
+    outcome.history_bytes = history.nbytes()
+    state.turn_outcomes.append(outcome)
+    return response
 
 def main():
+    warm_resources = get_warm_resources()
     st.title("Collins Family Mediation AI Intermediary")
     # Initialize session state
     initialize_session_state()
 
-    conversation_id = st.session_state.conversation_id
-
-  # Initialize Pinecone with error handling
-    try:
-        pc = pinecone.Pinecone(api_key=st.secrets["pinecone"]["api_key"])
-        index = pc.Index("mediation4")
-        st.success("Pinecone initialized successfully")
-    except Exception as e:
-        st.error(f"Failed to initialize Pinecone: {e}")
-        return
+    # Pinecone status; filled in once a turn needs the index
+    status_placeholder = st.empty()
 
     # Select the model dynamically
     selected_model_name = "gpt-4o"  # Change to "gpt-4o-mini" if needed
-    api_manager = APIManager(index, model_name=selected_model_name)
 
     # Display the AI response
     # Create a container for the main content
@@ -255,7 +487,8 @@ def main():
     
     # Use the main container for the response
     with main_container:
-        st.write(st.session_state.current_response)
+        response_placeholder = st.empty()
+        response_placeholder.write(st.session_state.current_response)
         
         # Add some spacing
         st.markdown("<br>" * 2, unsafe_allow_html=True)
@@ -264,38 +497,29 @@ def main():
     with input_container:
         user_input = st.chat_input("Your response:")
 
-    if user_input:
-        # Store user message in conversation memory
-        api_manager.store_conversation_turn(conversation_id, "user", user_input)
-
-        # Add user message to conversation history
-        st.session_state.messages.append({"role": "user", "content": user_input})
-
-        # Query Pinecone for relevant info (including past conversation turns and documents)
-        relevant_info = api_manager.query_pinecone(user_input)
-        if relevant_info:
-            st.session_state.backend_messages.append({
-                "role": "system",
-                "content": f"Relevant context:\n{relevant_info}"
-            })
-
-        # Combine messages for API call
-        full_context = (
-            [st.session_state.messages[0]]  # system message
-            + st.session_state.backend_messages
-            + st.session_state.messages[1:]
-        )
-
-        # Generate response
-        response = api_manager.generate_response(full_context)
-        st.session_state.current_response = response
-        st.session_state.messages.append({"role": "assistant", "content": response})
+    if not user_input:
+        # Page load: fetch context for the opening phases before the first
+        # answer, but only if the index handle is already there; never wait here
+        if warm_resources.ready():
+            try:
+                api_manager = APIManager(
+                    get_pinecone_index(), model_name=selected_model_name, metadata_store=get_metadata_store()
+                )
+                prefetch_intake_phases(api_manager, st.session_state, st.session_state.intake_phase)
+            except Exception as e:
+                print(f"Error in page load prefetch: {str(e)}")
+        return
 
-        # Store assistant message in conversation memory
-        api_manager.store_conversation_turn(conversation_id, "assistant", response)
+    # Initialize Pinecone with error handling; only a turn waits for the warmup
+    try:
+        index = get_pinecone_index()
+        status_placeholder.success("Pinecone initialized successfully")
+    except Exception as e:
+        status_placeholder.error(f"Failed to initialize Pinecone: {e}")
+        return
 
-        # Refresh display
-        st.rerun()
+    api_manager = APIManager(index, model_name=selected_model_name, metadata_store=get_metadata_store())
+    handle_turn(api_manager, st.session_state, user_input, response_placeholder.write_stream)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,120 @@
+from compact_conversations import SUMMARY_TYPE, compact
+from local_index import LocalIndex
+from metadata_store import LocalMetadataStore, split_metadata
+
+NOW = 1_700_000_000
+DAY = 86400
+
+def add_turn(index, conversation_id, role, text, position=None, created_at=None, values=(1.0, 0.0),
+             metadata_store=None):
+    vector_id = f"conversation_{conversation_id}_{role}_{index.describe_index_stats()['total_vector_count']}"
+    metadata = {"conversation_id": conversation_id, "role": role, "snippet": text, "type": "conversation"}
+    if position is not None:
+        metadata["position"] = position
+    if created_at is not None:
+        metadata["created_at"] = created_at
+    if metadata_store is not None:
+        metadata, record = split_metadata(metadata)
+        metadata_store.put_many({vector_id: record})
+    index.upsert(vectors=[(vector_id, list(values), metadata)])
+    return vector_id
+
+def summaries(index):
+    vectors = index.fetch(ids=[vector_id for page in index.list(prefix="conversation_") for vector_id in page])
+    return [vector for vector in vectors["vectors"].values() if vector["metadata"].get("type") == SUMMARY_TYPE]
+
+def test_turns_without_position_are_kept():
+    index = LocalIndex()
+    add_turn(index, "legacy", "user", "My name is Dana.")
+    add_turn(index, "legacy", "assistant", "Thank you, Dana. What is your spouse's name?")
+    add_turn(index, "legacy", "user", "Sam.")
+    add_turn(index, "legacy", "assistant", "How long have you been married?")
+
+    report = compact(index, now=NOW)
+
+    assert report.conversations_skipped == 1
+    assert report.conversations_compacted == 0
+    assert report.vectors_after == 4
+
+def test_turns_of_unknown_age_are_summarized_in_order_not_expired():
+    index = LocalIndex()
+    # Same created_at second, and the assistant id sorts before the user id
+    add_turn(index, "old", "user", "My name is Dana.", position=0)
+    add_turn(index, "old", "assistant", "Thank you, Dana. What is your spouse's name?", position=1)
+    add_turn(index, "old", "user", "Sam.", position=2)
+    add_turn(index, "old", "assistant", "How long have you been married?", position=3)
+
+    report = compact(index, now=NOW)
+
+    assert report.conversations_compacted == 1
+    assert report.summary_vectors_written == 1
+    assert report.vectors_after == 1
+    [summary] = summaries(index)
+    assert summary["metadata"]["snippet"].splitlines() == [
+        "User: My name is Dana.",
+        "Assistant: Thank you, Dana. What is your spouse's name?",
+        "User: Sam.",
+        "Assistant: How long have you been married?",
+    ]
+    assert "created_at" not in summary["metadata"]
+
+    # A summary of unknown age survives later runs too
+    report = compact(index, now=NOW + 1000 * DAY)
+    assert report.summaries_expired == 0
+    assert report.vectors_after == 1
+
+def test_active_conversation_is_left_alone():
+    index = LocalIndex()
+    add_turn(index, "live", "user", "We separated last year.", 0, created_at=NOW - 2 * DAY)
+    add_turn(index, "live", "assistant", "I understand.", 1, created_at=NOW - 60)
+
+    report = compact(index, now=NOW)
+
+    assert report.conversations_active == 1
+    assert report.conversations_compacted == 0
+    assert report.vectors_after == 2
+
+def test_closed_conversation_is_rolled_up():
+    index = LocalIndex()
+    add_turn(index, "closed", "user", "We have two kids.", 0, created_at=NOW - 3 * DAY)
+    add_turn(index, "closed", "assistant", "How old are they?", 1, created_at=NOW - 3 * DAY + 30)
+
+    report = compact(index, now=NOW)
+
+    assert report.message_vectors_deleted == 2
+    assert report.summary_vectors_written == 1
+    [summary] = summaries(index)
+    assert summary["metadata"]["created_at"] == NOW - 3 * DAY + 30
+
+def test_retention_expires_old_messages_and_summaries():
+    index = LocalIndex()
+    add_turn(index, "ancient", "user", "Hello.", created_at=NOW - 400 * DAY)
+    index.upsert(vectors=[("conversation_stale_summary_0", [1.0, 0.0], {
+        "conversation_id": "stale", "type": SUMMARY_TYPE, "snippet": "Old summary", "created_at": NOW - 400 * DAY
+    })])
+
+    report = compact(index, retention_days=365, now=NOW)
+
+    assert report.summaries_expired == 1
+    assert report.message_vectors_deleted == 1
+    assert report.summary_vectors_written == 0
+    assert report.vectors_after == 0
+
+def test_id_only_index_without_store_is_not_deleted():
+    index = LocalIndex()
+    store = LocalMetadataStore(":memory:")
+    add_turn(index, "idonly", "user", "My spouse is Sam.", 0, created_at=NOW - 3 * DAY, metadata_store=store)
+    add_turn(index, "idonly", "assistant", "Thank you.", 1, created_at=NOW - 3 * DAY, metadata_store=store)
+
+    report = compact(index, now=NOW)
+
+    assert report.conversations_skipped == 1
+    assert report.conversations_compacted == 0
+    assert report.vectors_after == 2
+
+    report = compact(index, metadata_store=store, now=NOW)
+
+    assert report.conversations_compacted == 1
+    [summary] = summaries(index)
+    assert "snippet" not in summary["metadata"]
+    assert "Sam" in store.get_many(["conversation_idonly_summary_0"])["conversation_idonly_summary_0"]["snippet"]
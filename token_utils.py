@@ -0,0 +1,92 @@
+import re
+from typing import List
+
+# gpt-4o and gpt-4o-mini share this encoding
+ENCODING_NAME = "o200k_base"
+# Fallback when tiktoken is not installed; close enough for budgeting English text
+CHARS_PER_TOKEN = 4
+
+_encoding = None
+_encoding_loaded = False
+
+def get_encoding():
+    # tiktoken is optional and slow to load, so it is imported on first use
+    # (or by warmup.py at server start)
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(ENCODING_NAME)
+        except ImportError:
+            _encoding = None
+        _encoding_loaded = True
+    return _encoding
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    encoding = get_encoding()
+    if encoding is None:
+        return max(1, len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode(text))
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+    encoding = get_encoding()
+    if encoding is None:
+        truncated = text[:max_tokens * CHARS_PER_TOKEN]
+    else:
+        truncated = encoding.decode(encoding.encode(text)[:max_tokens])
+    return truncated.rstrip() + "…"
+
+def _longest_prefix(text: str, max_tokens: int) -> int:
+    # Characters of text that fit in max_tokens (at least one)
+    low, high = 1, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(text[:middle]) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+def _hard_split(text: str, max_tokens: int) -> List[str]:
+    # Cuts between words, and inside a word only when the word alone is over
+    # the limit. Cuts fall between characters, never inside a multi-byte one.
+    parts, current = [], ""
+    for word in re.findall(r"\S+\s*|\s+", text):
+        if count_tokens(current + word) <= max_tokens:
+            current += word
+            continue
+        if current:
+            parts.append(current)
+        while count_tokens(word) > max_tokens:
+            cut = _longest_prefix(word, max_tokens)
+            parts.append(word[:cut])
+            word = word[cut:]
+        current = word
+    if current:
+        parts.append(current)
+    return parts
+
+def split_into_chunks(text: str, max_tokens: int) -> List[str]:
+    # Packs whole sentences into chunks of at most max_tokens; a sentence longer
+    # than that is cut between words. Chunks keep the whitespace that followed
+    # them, so "".join(chunks) == text.
+    if count_tokens(text) <= max_tokens:
+        return [text]
+    chunks, current = [], ""
+    for sentence in re.findall(r".+?(?:[.!?]\s+|\n\s*\n|\Z)", text, re.S):
+        if current and count_tokens(current + sentence) > max_tokens:
+            chunks.append(current)
+            current = ""
+        if count_tokens(sentence) > max_tokens:
+            chunks.extend(_hard_split(sentence, max_tokens))
+            continue
+        current += sentence
+    if current:
+        chunks.append(current)
+    return chunks
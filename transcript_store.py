@@ -0,0 +1,102 @@
+import sqlite3
+import threading
+import time
+from typing import Dict, List
+
+# Durable per-conversation transcripts. Session history spills here so server
+# memory only holds recent turns, and offline jobs read full conversations back.
+
+class LocalTranscriptStore:
+    def __init__(self, path: str = "transcripts.db"):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS turns ("
+            "conversation_id TEXT NOT NULL, position INTEGER NOT NULL, role TEXT NOT NULL, "
+            "content TEXT NOT NULL, created_at REAL NOT NULL, PRIMARY KEY (conversation_id, position))"
+        )
+        self._conn.commit()
+
+    def append(self, conversation_id: str, start_position: int, turns: List[Dict]):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO turns (conversation_id, position, role, content, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [
+                    (conversation_id, start_position + offset, turn["role"], turn["content"],
+                     turn.get("created_at", now))
+                    for offset, turn in enumerate(turns)
+                ]
+            )
+            self._conn.commit()
+
+    def load(self, conversation_id: str, end_position: int = None) -> List[Dict]:
+        # With end_position, only turns before that position are read
+        query = "SELECT role, content, created_at FROM turns WHERE conversation_id = ?"
+        params = [conversation_id]
+        if end_position is not None:
+            query += " AND position < ?"
+            params.append(end_position)
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY position", params).fetchall()
+        return [{"role": role, "content": content, "created_at": created_at} for role, content, created_at in rows]
+
+    def conversations(self, idle_seconds: float = 0) -> List[str]:
+        # Conversations with no new turns for at least idle_seconds
+        cutoff = time.time() - idle_seconds
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT conversation_id FROM turns GROUP BY conversation_id "
+                "HAVING MAX(created_at) <= ? ORDER BY conversation_id",
+                (cutoff,)
+            ).fetchall()
+        return [conversation_id for (conversation_id,) in rows]
+
+def open_transcript_store(location: str):
+    # Offline jobs name the store the app uses: a mongodb:// URI or a SQLite path
+    if location.startswith(("mongodb://", "mongodb+srv://")):
+        return MongoTranscriptStore(location)
+    return LocalTranscriptStore(location)
+
+class MongoTranscriptStore:
+    def __init__(self, uri: str, database: str = "mediation", collection: str = "transcripts"):
+        from pymongo import MongoClient
+        self._collection = MongoClient(uri)[database][collection]
+
+    def append(self, conversation_id: str, start_position: int, turns: List[Dict]):
+        from pymongo import ReplaceOne
+        now = time.time()
+        if turns:
+            self._collection.bulk_write([
+                ReplaceOne(
+                    {"conversation_id": conversation_id, "position": start_position + offset},
+                    {
+                        "conversation_id": conversation_id,
+                        "position": start_position + offset,
+                        "role": turn["role"],
+                        "content": turn["content"],
+                        "created_at": turn.get("created_at", now),
+                    },
+                    upsert=True
+                )
+                for offset, turn in enumerate(turns)
+            ])
+
+    def load(self, conversation_id: str, end_position: int = None) -> List[Dict]:
+        query = {"conversation_id": conversation_id}
+        if end_position is not None:
+            query["position"] = {"$lt": end_position}
+        return [
+            {"role": document["role"], "content": document["content"], "created_at": document["created_at"]}
+            for document in self._collection.find(query).sort("position", 1)
+        ]
+
+    def conversations(self, idle_seconds: float = 0) -> List[str]:
+        cutoff = time.time() - idle_seconds
+        return sorted(
+            group["_id"] for group in self._collection.aggregate([
+                {"$group": {"_id": "$conversation_id", "last": {"$max": "$created_at"}}},
+                {"$match": {"last": {"$lte": cutoff}}},
+            ])
+        )
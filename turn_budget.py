@@ -0,0 +1,172 @@
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Tuple
+
+# Starting guess for a Pinecone query, which has no MODEL_CONFIGS entry; the
+# estimates are replaced by observed timings as turns complete
+PINECONE_QUERY_ESTIMATE_MS = 150.0
+
+# Weight given to the newest observation when updating a latency estimate
+EWMA_ALPHA = 0.3
+# Share of the gap to the MODEL_CONFIGS baseline closed on each turn a model
+# does not run, so one slow reply cannot lock the session onto the fallback
+STALE_DECAY = 0.3
+# After this many fallbacks in a row the preferred model is tried anyway, so
+# its estimate is refreshed from a real reply; a prior that no longer fits the
+# budget would otherwise never be tested again
+PROBE_AFTER_FALLBACKS = 3
+
+class Deadline:
+    def __init__(self, budget_seconds: float):
+        self.budget_seconds = budget_seconds
+        self.started_at = time.monotonic()
+
+    def elapsed_ms(self) -> float:
+        return (time.monotonic() - self.started_at) * 1000
+
+    def remaining_ms(self) -> float:
+        return max(0.0, self.budget_seconds * 1000 - self.elapsed_ms())
+
+    def remaining_seconds(self) -> float:
+        return self.remaining_ms() / 1000
+
+    def can_afford(self, estimate_ms: float) -> bool:
+        return estimate_ms <= self.remaining_ms()
+
+    def expired(self) -> bool:
+        return self.remaining_ms() <= 0
+
+@dataclass
+class StageOutcome:
+    name: str
+    status: str  # "ran", "skipped", "failed" or "prefetched"
+    elapsed_ms: float = 0.0
+    estimate_ms: float = 0.0
+
+@dataclass
+class TurnOutcome:
+    slo_seconds: float
+    model_name: str = ""
+    stages: List[StageOutcome] = field(default_factory=list)
+    # Time to the first streamed token of the reply
+    first_reply_ms: float = 0.0
+    met_slo: bool = False
+    # In-memory size of the session's history after the turn
+    history_bytes: int = 0
+
+    def skipped_stages(self) -> List[str]:
+        return [stage.name for stage in self.stages if stage.status == "skipped"]
+
+class TurnExecutor:
+    def __init__(self, model_configs: Dict, slo_seconds: float = 2.5,
+                 embedding_model: str = "text-embedding-3-large"):
+        self.model_configs = model_configs
+        self.slo_seconds = slo_seconds
+        self.estimates_ms = {
+            "retrieval": model_configs[embedding_model].latency_ms + PINECONE_QUERY_ESTIMATE_MS
+        }
+        # Generation estimates are time to first token; latency_ms is the prior
+        self.baselines_ms = {
+            f"generate:{name}": model_configs[name].latency_ms for name in self.chat_models()
+        }
+        self.estimates_ms.update(self.baselines_ms)
+        self.fallback_streak = 0
+
+    def chat_models(self) -> List[str]:
+        return [name for name in self.model_configs if not name.startswith("text-embedding")]
+
+    def start_turn(self) -> Tuple[Deadline, TurnOutcome]:
+        return Deadline(self.slo_seconds), TurnOutcome(slo_seconds=self.slo_seconds)
+
+    def estimate(self, name: str) -> float:
+        return self.estimates_ms.get(name, 0.0)
+
+    def observe(self, name: str, elapsed_ms: float):
+        previous = self.estimates_ms.get(name)
+        if previous is None:
+            self.estimates_ms[name] = elapsed_ms
+        else:
+            self.estimates_ms[name] = (1 - EWMA_ALPHA) * previous + EWMA_ALPHA * elapsed_ms
+
+    def run_optional(self, deadline: Deadline, outcome: TurnOutcome, name: str,
+                     fn: Callable, *args, default: Any = None, **kwargs):
+        # Optional stages are skipped outright when the remaining budget cannot
+        # cover their estimated cost
+        estimate_ms = self.estimate(name)
+        if not deadline.can_afford(estimate_ms):
+            outcome.stages.append(StageOutcome(name, "skipped", 0.0, estimate_ms))
+            return default
+        return self._run(outcome, name, estimate_ms, fn, *args, **kwargs)
+
+    def run_required(self, outcome: TurnOutcome, name: str, fn: Callable, *args, **kwargs):
+        return self._run(outcome, name, self.estimate(name), fn, *args, **kwargs)
+
+    def _run(self, outcome: TurnOutcome, name: str, estimate_ms: float,
+             fn: Callable, *args, **kwargs):
+        started = time.monotonic()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            elapsed_ms = (time.monotonic() - started) * 1000
+            outcome.stages.append(StageOutcome(name, "failed", elapsed_ms, estimate_ms))
+            print(f"Error in turn stage {name}: {str(e)}")
+            raise
+        elapsed_ms = (time.monotonic() - started) * 1000
+        outcome.stages.append(StageOutcome(name, "ran", elapsed_ms, estimate_ms))
+        return result
+
+    def track_stream(self, deadline: Deadline, outcome: TurnOutcome, name: str, stream):
+        # Passes a streamed reply through; the stage is timed to its first chunk,
+        # which is also when the turn counts as answered
+        estimate_ms = self.estimate(name)
+        started = time.monotonic()
+        first = True
+        try:
+            for chunk in stream:
+                if first:
+                    first = False
+                    outcome.stages.append(
+                        StageOutcome(name, "ran", (time.monotonic() - started) * 1000, estimate_ms)
+                    )
+                    outcome.first_reply_ms = deadline.elapsed_ms()
+                yield chunk
+        except Exception as e:
+            outcome.stages.append(
+                StageOutcome(name, "failed", (time.monotonic() - started) * 1000, estimate_ms)
+            )
+            print(f"Error in turn stage {name}: {str(e)}")
+            raise
+
+    def choose_model(self, deadline: Deadline, preferred: str) -> str:
+        # Keep the preferred model while it fits the remaining budget, otherwise
+        # fall back to the fastest chat model that does
+        if deadline.can_afford(self.estimate(f"generate:{preferred}")):
+            self.fallback_streak = 0
+            return preferred
+        if self.fallback_streak >= PROBE_AFTER_FALLBACKS:
+            self.fallback_streak = 0
+            return preferred
+        self.fallback_streak += 1
+        candidates = sorted(self.chat_models(), key=lambda name: self.estimate(f"generate:{name}"))
+        for name in candidates:
+            if deadline.can_afford(self.estimate(f"generate:{name}")):
+                return name
+        return candidates[0] if candidates else preferred
+
+    def finish_turn(self, deadline: Deadline, outcome: TurnOutcome, model_name: str) -> TurnOutcome:
+        # Called once the reply is on screen; later stages (persistence) are
+        # still appended to outcome.stages but do not count against the SLO
+        outcome.model_name = model_name
+        if not outcome.first_reply_ms:
+            outcome.first_reply_ms = deadline.elapsed_ms()
+        outcome.met_slo = outcome.first_reply_ms <= self.slo_seconds * 1000
+        ran = set()
+        for stage in outcome.stages:
+            if stage.status == "ran":
+                self.observe(stage.name, stage.elapsed_ms)
+                ran.add(stage.name)
+        # Estimates of models that were not used drift back to their baseline
+        for name, baseline_ms in self.baselines_ms.items():
+            if name not in ran:
+                self.estimates_ms[name] += STALE_DECAY * (baseline_ms - self.estimates_ms[name])
+        return outcome
@@ -0,0 +1,62 @@
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict
+
+# Builds expensive process-wide resources (API clients, the index handle, the
+# tokenizer) on background threads. The apps start it on the first script run
+# in a server process, so the page renders while they build and the first
+# turn usually finds them ready. Each resource may also have a warmer that
+# runs after it is built, e.g. a cheap request that opens the HTTPS connection.
+
+class Warmup:
+    def __init__(self, builders: Dict[str, Callable], warmers: Dict[str, Callable] = None):
+        self.builders = builders
+        self.timings_ms = {}
+        self._futures = {name: Future() for name in builders}
+        self._lock = threading.Lock()
+        for name, build in builders.items():
+            threading.Thread(
+                target=self._run,
+                args=(name, build, (warmers or {}).get(name)),
+                name=f"warmup-{name}",
+                daemon=True
+            ).start()
+
+    def _run(self, name: str, build: Callable, warm: Callable):
+        started = time.perf_counter()
+        try:
+            resource = build()
+        except Exception as e:
+            print(f"Error in warmup of {name}: {str(e)}")
+            self._futures[name].set_exception(e)
+            return
+        self.timings_ms[name] = (time.perf_counter() - started) * 1000
+        self._futures[name].set_result(resource)
+        if warm is not None:
+            started = time.perf_counter()
+            try:
+                warm(resource)
+            except Exception as e:
+                print(f"Error warming {name}: {str(e)}")
+            self.timings_ms[f"{name}:warm"] = (time.perf_counter() - started) * 1000
+
+    def get(self, name: str):
+        # Waits for a build still in progress; a failed build is retried here so
+        # one bad start does not poison the process for good
+        future = self._futures[name]
+        try:
+            return future.result()
+        except Exception:
+            with self._lock:
+                if self._futures[name] is future:
+                    retry = Future()
+                    try:
+                        retry.set_result(self.builders[name]())
+                    except Exception as e:
+                        retry.set_exception(e)
+                    self._futures[name] = retry
+            return self._futures[name].result()
+
+    def ready(self) -> bool:
+        return all(future.done() for future in self._futures.values())